@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import os
+import random
+import socket
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+from database import adquirir_lock, renovar_lock, liberar_lock, dono_lock, chave_conta, CONTA_PADRAO
+from contas import contas_configuradas
+from sincronizacao import sincronizar_produtos, ultima_sincronizacao
+from tarefas import submeter
+
+logger = logging.getLogger(__name__)
+
+# Sincronizacao periodica: SYNC_CRON ("min hora dia mes dia_semana") tem precedencia sobre o
+# intervalo; os dois vazios/0 desligam o agendador
+SYNC_INTERVALO_MINUTOS = float(os.getenv("SYNC_INTERVALO_MINUTOS", "0"))
+SYNC_CRON = os.getenv("SYNC_CRON", "").strip()
+# Atraso aleatorio somado a cada disparo, para os workers nao acordarem juntos
+SYNC_JITTER_SEGUNDOS = float(os.getenv("SYNC_JITTER_SEGUNDOS", "30"))
+# Duracao do lease; renovado a cada terco enquanto a sincronizacao roda
+SYNC_LOCK_SEGUNDOS = float(os.getenv("SYNC_LOCK_SEGUNDOS", "120"))
+
+# Um lease por conta Omie: contas diferentes sincronizam ao mesmo tempo
+LOCK_SINCRONIZACAO = "sincronizacao"
+# Identifica este processo na tabela de locks
+DONO = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+MENSAGEM_EM_ANDAMENTO = "Sincronizacao desta conta ja em andamento"
+
+# O lease aceita o proprio dono de novo; dentro do processo, este lock por conta impede que uma
+# sincronizacao completa e uma incremental rodem juntas
+_locks_locais = {}
+_lock_locais = threading.Lock()
+
+
+class SincronizacaoEmAndamento(RuntimeError):
+    pass
+
+
+def _campo_cron(campo: str, minimo: int, maximo: int) -> set:
+    valores = set()
+    for parte in campo.split(","):
+        faixa, _, passo = parte.partition("/")
+        if faixa == "*":
+            inicio, fim = minimo, maximo
+        elif "-" in faixa:
+            inicio, fim = (int(v) for v in faixa.split("-"))
+        else:
+            inicio = fim = int(faixa)
+            if passo:
+                fim = maximo
+        if inicio < minimo or fim > maximo or inicio > fim:
+            raise ValueError(f"Campo cron fora do intervalo: {campo}")
+        valores.update(range(inicio, fim + 1, int(passo) if passo else 1))
+    return valores
+
+
+class Cron:
+    """Expressao cron de cinco campos (minuto hora dia mes dia_da_semana, domingo = 0 ou 7)."""
+
+    def __init__(self, expressao: str):
+        campos = expressao.split()
+        if len(campos) != 5:
+            raise ValueError(f"Expressao cron deve ter 5 campos: {expressao!r}")
+        self.minutos = _campo_cron(campos[0], 0, 59)
+        self.horas = _campo_cron(campos[1], 0, 23)
+        self.dias = _campo_cron(campos[2], 1, 31)
+        self.meses = _campo_cron(campos[3], 1, 12)
+        self.dias_semana = {d % 7 for d in _campo_cron(campos[4], 0, 7)}
+        self.dia_livre = campos[2] == "*"
+        self.semana_livre = campos[4] == "*"
+
+    def _dia_confere(self, momento: datetime) -> bool:
+        dia = momento.day in self.dias
+        semana = (momento.isoweekday() % 7) in self.dias_semana
+        # Como no cron: com dia do mes e dia da semana restritos, basta um dos dois
+        if self.dia_livre or self.semana_livre:
+            return dia and semana
+        return dia or semana
+
+    def proxima(self, depois: datetime) -> datetime:
+        momento = depois.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limite = momento + timedelta(days=366 * 4)
+        while momento < limite:
+            if momento.month not in self.meses or not self._dia_confere(momento):
+                momento = (momento + timedelta(days=1)).replace(hour=0, minute=0)
+            elif momento.hour not in self.horas:
+                momento = (momento + timedelta(hours=1)).replace(minute=0)
+            elif momento.minute not in self.minutos:
+                momento += timedelta(minutes=1)
+            else:
+                return momento
+        raise ValueError("Expressao cron sem proxima execucao")
+
+
+def validar_configuracao():
+    """Chamada no startup: uma SYNC_CRON invalida derruba a aplicacao em vez do laco do agendador."""
+    if SYNC_CRON:
+        Cron(SYNC_CRON)
+
+
+def proxima_execucao(agora: datetime) -> Optional[datetime]:
+    if SYNC_CRON:
+        return Cron(SYNC_CRON).proxima(agora)
+    if SYNC_INTERVALO_MINUTOS > 0:
+        # Proximo multiplo do intervalo desde a epoch (como o cron): todos os workers calculam o
+        # mesmo disparo, independentemente de quando cada um subiu
+        intervalo = SYNC_INTERVALO_MINUTOS * 60
+        return datetime.fromtimestamp((int(agora.timestamp() // intervalo) + 1) * intervalo)
+    return None
+
+
+def chave_sincronizacao(conta: str, incremental: bool) -> tuple:
+    # Chave de coalescencia em tarefas: so junta pedidos da mesma conta e do mesmo modo
+    return ("sincronizar", conta, "incremental" if incremental else "completo")
+
+
+def _lock_local(conta: str) -> threading.Lock:
+    with _lock_locais:
+        return _locks_locais.setdefault(conta, threading.Lock())
+
+
+def sincronizacao_em_outro_processo(conta: str = CONTA_PADRAO) -> bool:
+    dono = dono_lock(chave_conta(LOCK_SINCRONIZACAO, conta))
+    return dono is not None and dono != DONO
+
+
+def sincronizar_exclusivo(incremental: bool = True, progresso: Optional[Callable] = None,
+                          nao_antes_de: Optional[datetime] = None, conta: str = CONTA_PADRAO) -> dict:
+    """Roda a sincronizacao segurando o lease; falha se a conta ja esta sincronizando, neste ou
+    em outro processo.
+
+    Com `nao_antes_de`, nao faz nada se outra execucao ja comecou depois desse horario
+    (o disparo agendado ja foi atendido por outro worker).
+    """
+    local = _lock_local(conta)
+    if not local.acquire(blocking=False):
+        raise SincronizacaoEmAndamento(MENSAGEM_EM_ANDAMENTO)
+    try:
+        return _sincronizar_com_lease(incremental, progresso, nao_antes_de, conta)
+    finally:
+        local.release()
+
+
+def _sincronizar_com_lease(incremental: bool, progresso: Optional[Callable],
+                           nao_antes_de: Optional[datetime], conta: str) -> dict:
+    lock = chave_conta(LOCK_SINCRONIZACAO, conta)
+    if not adquirir_lock(lock, DONO, SYNC_LOCK_SEGUNDOS):
+        raise SincronizacaoEmAndamento(MENSAGEM_EM_ANDAMENTO)
+    parar = threading.Event()
+    perdido = threading.Event()
+
+    def renovar():
+        while not parar.wait(SYNC_LOCK_SEGUNDOS / 3):
+            try:
+                renovado = renovar_lock(lock, DONO, SYNC_LOCK_SEGUNDOS)
+            except sqlite3.Error as e:
+                # Banco ocupado: tenta de novo no proximo terco, o lease ainda nao venceu
+                logger.warning("Falha ao renovar o lease da sincronizacao da conta %s: %s", conta, e)
+                continue
+            if not renovado:
+                # Outro processo assumiu: para antes de gravar a proxima pagina
+                logger.warning("Lease da sincronizacao da conta %s perdido; interrompendo", conta)
+                perdido.set()
+                return
+
+    renovacao = threading.Thread(target=renovar, name=f"lock-sincronizacao-{conta}", daemon=True)
+    renovacao.start()
+    try:
+        if nao_antes_de is not None:
+            marca = ultima_sincronizacao(conta)
+            # O disparo e horario local deste servidor; a marca traz o offset do Omie
+            if marca is not None and marca >= nao_antes_de.astimezone():
+                return {"modo": "ignorada", "produtos": 0, "gravados": 0}
+        return sincronizar_produtos(incremental=incremental, progresso=progresso, conta=conta,
+                                    interromper=perdido)
+    finally:
+        parar.set()
+        renovacao.join()
+        liberar_lock(lock, DONO)
+
+
+async def executar():
+    """Laco do agendador, iniciado no lifespan da aplicacao (um por worker)."""
+    while True:
+        agora = datetime.now()
+        disparo = proxima_execucao(agora)
+        if disparo is None:
+            return
+        espera = (disparo - agora).total_seconds() + random.uniform(0, SYNC_JITTER_SEGUNDOS)
+        await asyncio.sleep(max(0.0, espera))
+        # Uma tarefa por conta, com a mesma chave de /sincronizar: se ja houver uma sincronizacao
+        # incremental da conta neste processo, reaproveita
+        tarefas = {
+            conta: submeter("sincronizar", sincronizar_exclusivo, incremental=True, nao_antes_de=disparo,
+                            conta=conta, chave=chave_sincronizacao(conta, True))
+            for conta in contas_configuradas()
+        }
+        for conta, tarefa in tarefas.items():
+            await run_in_threadpool(tarefa.aguardar)
+            # Outro worker com o lease ja esta cuidando deste disparo
+            if tarefa.erro and tarefa.erro != MENSAGEM_EM_ANDAMENTO:
+                logger.warning("Sincronizacao agendada da conta %s falhou: %s", conta, tarefa.erro)
@@ -1,15 +1,37 @@
 from datetime import datetime, timedelta
 from jose import jwt, JWTError
 from passlib.context import CryptContext
-from typing import Optional
+from typing import Dict, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import os
+import time
 
-PWD_CONTEXT = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from cache import CacheTTL
+from database import get_user_by_username, set_user_active
+
+# Custo do bcrypt; hashes com custo menor sao refeitos no proximo login (verify_and_update)
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PWD_CONTEXT = CryptContext(schemes=["bcrypt"], deprecated="auto",
+                           bcrypt__default_rounds=BCRYPT_ROUNDS, bcrypt__min_rounds=BCRYPT_ROUNDS)
+
+# Pool dedicado ao bcrypt: o hashing nunca roda no event loop e nao ocupa o threadpool das rotas
+SENHA_MAX_WORKERS = int(os.getenv("SENHA_MAX_WORKERS", "2"))
+_executor_senhas = ThreadPoolExecutor(max_workers=SENHA_MAX_WORKERS, thread_name_prefix="bcrypt")
 
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "change_me")
 ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "60"))
 
+# Cache de tokens ja verificados (nunca alem do 'exp') e de usuarios ativos
+TOKEN_CACHE_ITENS = int(os.getenv("TOKEN_CACHE_ITENS", "10000"))
+TOKEN_CACHE_TTL = int(os.getenv("TOKEN_CACHE_TTL", "300"))
+USUARIO_CACHE_ITENS = int(os.getenv("USUARIO_CACHE_ITENS", "1000"))
+USUARIO_CACHE_TTL = int(os.getenv("USUARIO_CACHE_TTL", "60"))
+
+_cache_tokens = CacheTTL(max_itens=TOKEN_CACHE_ITENS, ttl=TOKEN_CACHE_TTL, nome="tokens")
+_cache_usuarios = CacheTTL(max_itens=USUARIO_CACHE_ITENS, ttl=USUARIO_CACHE_TTL, nome="usuarios")
+
 
 def verify_password(plain_password, hashed_password):
     return PWD_CONTEXT.verify(plain_password, hashed_password)
@@ -19,6 +41,17 @@ def get_password_hash(password):
     return PWD_CONTEXT.hash(password)
 
 
+async def verify_and_update_password_async(plain_password, hashed_password) -> Tuple[bool, Optional[str]]:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor_senhas, PWD_CONTEXT.verify_and_update,
+                                      plain_password, hashed_password)
+
+
+async def get_password_hash_async(password) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor_senhas, PWD_CONTEXT.hash, password)
+
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -39,3 +72,37 @@ def decode_access_token(token: str) -> dict:
         return payload
     except JWTError as e:
         raise
+
+
+def decode_access_token_cached(token: str) -> dict:
+    payload = _cache_tokens.get(token)
+    if payload is None:
+        payload = decode_access_token(token)
+        restante = payload.get("exp", 0) - time.time()
+        if restante > 0:
+            _cache_tokens.set(token, payload, ttl=min(TOKEN_CACHE_TTL, restante))
+    return payload
+
+
+def get_cached_user(username: str) -> Optional[Dict]:
+    # So o cache, sem SQLite: pode ser chamado direto no event loop
+    return _cache_usuarios.get(username)
+
+
+def get_active_user(username: str) -> Optional[Dict]:
+    user = _cache_usuarios.get(username)
+    if user is None:
+        user = get_user_by_username(username)
+        if not user or not user.get("is_active"):
+            return None
+        _cache_usuarios.set(username, user)
+    return user
+
+
+def invalidate_user(username: str):
+    _cache_usuarios.remover(username)
+
+
+def set_user_status(username: str, active: bool):
+    set_user_active(username, active)
+    invalidate_user(username)
@@ -0,0 +1,56 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from metricas import CACHE_CONSULTAS
+
+
+class CacheTTL:
+    """Cache LRU limitado em tamanho, com expiracao por entrada (thread-safe)."""
+
+    def __init__(self, max_itens: int = 128, ttl: Optional[float] = None, nome: Optional[str] = None):
+        self.nome = nome
+        self.max_itens = max_itens
+        self.ttl = ttl
+        self._dados = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, chave: Hashable, padrao: Any = None) -> Any:
+        valor = self._get(chave, padrao)
+        if self.nome:
+            CACHE_CONSULTAS.inc(cache=self.nome, resultado="acerto" if valor is not padrao else "falha")
+        return valor
+
+    def _get(self, chave: Hashable, padrao: Any) -> Any:
+        with self._lock:
+            item = self._dados.get(chave)
+            if item is None:
+                return padrao
+            valor, expira = item
+            if expira is not None and expira <= time.monotonic():
+                del self._dados[chave]
+                return padrao
+            self._dados.move_to_end(chave)
+            return valor
+
+    def set(self, chave: Hashable, valor: Any, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        expira = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._dados[chave] = (valor, expira)
+            self._dados.move_to_end(chave)
+            while len(self._dados) > self.max_itens:
+                self._dados.popitem(last=False)
+
+    def remover(self, chave: Hashable):
+        with self._lock:
+            self._dados.pop(chave, None)
+
+    def limpar(self):
+        with self._lock:
+            self._dados.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._dados)
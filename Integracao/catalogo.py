@@ -0,0 +1,106 @@
+import os
+import threading
+import time
+from bisect import bisect_right
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import database
+from database import CAMPOS_PRODUTO, CONTA_PADRAO, campos_projecao, ler_catalogo, versao_catalogo
+from respostas import serializar
+
+# Intervalo minimo entre consultas de versao_catalogo no banco; dentro dele as leituras nao
+# tocam o SQLite. As leituras enxergam uma sincronizacao com no maximo esse atraso.
+CATALOGO_VERIFICACAO_SEGUNDOS = float(os.getenv("CATALOGO_VERIFICACAO_SEGUNDOS", "1"))
+
+
+class Catalogo:
+    """Copia imutavel do catalogo, em colunas (tuplas) ordenadas por id.
+
+    Cada produto ja fica serializado em JSON: a pagina padrao de /produtos e so uma
+    concatenacao de bytes, sem montar dicts por requisicao.
+    """
+
+    __slots__ = ("versao", "caminho", "ids", "colunas", "hashes", "json_linhas")
+
+    def __init__(self, versao: int, linhas: List[tuple], caminho: Optional[str] = None):
+        n = len(CAMPOS_PRODUTO)
+        colunas = tuple(zip(*linhas)) if linhas else ((),) * (n + 1)
+        self.versao = versao
+        self.caminho = caminho
+        self.ids = colunas[0]
+        self.colunas = dict(zip(CAMPOS_PRODUTO, colunas[:n]))
+        self.hashes = colunas[n]
+        self.json_linhas = tuple(serializar(dict(zip(CAMPOS_PRODUTO, linha[:n]))) for linha in linhas)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _inicio(self, apos_id: int) -> int:
+        return bisect_right(self.ids, apos_id)
+
+    def posicao(self, id_produto: int) -> Optional[int]:
+        i = bisect_right(self.ids, id_produto) - 1
+        return i if i >= 0 and self.ids[i] == id_produto else None
+
+    def registro(self, i: int, campos: List[str]) -> Dict:
+        return {c: self.colunas[c][i] for c in campos}
+
+    def pagina(self, apos_id: int = 0, limite: int = 100,
+               campos: Optional[List[str]] = None) -> Tuple[List[Dict], Optional[int]]:
+        lista = campos_projecao(campos)
+        inicio = self._inicio(apos_id)
+        fim = min(inicio + limite, len(self.ids))
+        dados = [self.registro(i, lista) for i in range(inicio, fim)]
+        return dados, self._proximo(inicio, fim, limite)
+
+    def pagina_json(self, apos_id: int = 0, limite: int = 100) -> bytes:
+        """Corpo JSON {"dados": [...], "proximo_cursor": ...} com todas as colunas."""
+        inicio = self._inicio(apos_id)
+        fim = min(inicio + limite, len(self.ids))
+        return (b'{"dados":[' + b",".join(self.json_linhas[inicio:fim]) +
+                b'],"proximo_cursor":' + serializar(self._proximo(inicio, fim, limite)) + b"}")
+
+    def _proximo(self, inicio: int, fim: int, limite: int) -> Optional[int]:
+        return self.ids[fim - 1] if fim - inicio == limite else None
+
+    def linhas_ndjson(self, apos_id: int = 0, campos: Optional[List[str]] = None) -> Iterator[bytes]:
+        inicio = self._inicio(apos_id)
+        if not campos:
+            return (linha + b"\n" for linha in self.json_linhas[inicio:])
+        lista = campos_projecao(campos)
+        return (serializar(self.registro(i, lista)) + b"\n" for i in range(inicio, len(self.ids)))
+
+    def por_ids(self, ids: List[int], campos: Optional[List[str]] = None) -> List[Dict]:
+        lista = campos_projecao(campos)
+        posicoes = (self.posicao(i) for i in ids)
+        return [self.registro(p, lista) for p in posicoes if p is not None]
+
+    def registros(self) -> List[Dict]:
+        """Todos os produtos como dicts (com hash), para o agrupamento e o indice de similares."""
+        return [{**self.registro(i, CAMPOS_PRODUTO), "hash": self.hashes[i]} for i in range(len(self.ids))]
+
+
+# Uma copia por conta Omie
+_atuais: Dict[str, Catalogo] = {}
+_verificados_em: Dict[str, float] = {}
+_lock = threading.Lock()
+
+
+def obter_catalogo(conta: str = CONTA_PADRAO, verificar: bool = False) -> Catalogo:
+    """Catalogo em memoria da conta; `verificar` forca a conferencia da versao no banco."""
+    atual = _atuais.get(conta)
+    if (not verificar and atual is not None and atual.caminho == database.DB_PATH
+            and time.monotonic() - _verificados_em.get(conta, 0.0) < CATALOGO_VERIFICACAO_SEGUNDOS):
+        return atual
+    return _verificar(conta)
+
+
+def _verificar(conta: str) -> Catalogo:
+    with _lock:
+        atual = _atuais.get(conta)
+        if atual is None or atual.caminho != database.DB_PATH or atual.versao != versao_catalogo(conta):
+            versao, linhas = ler_catalogo(conta)
+            # Troca de referencia: quem ja pegou a copia anterior continua usando-a
+            atual = _atuais[conta] = Catalogo(versao, linhas, database.DB_PATH)
+        _verificados_em[conta] = time.monotonic()
+        return atual
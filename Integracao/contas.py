@@ -0,0 +1,39 @@
+import json
+import os
+from typing import Dict, List
+
+# Contas Omie (empresas) atendidas por esta instancia. Fica fora de omieAPI porque o banco
+# tambem precisa saber qual e a conta padrao.
+
+# Nome da unica conta antes de OMIE_CONTAS existir; bancos antigos tem os dados nela
+CONTA_LEGADA = "padrao"
+
+# Varias empresas: {"conta": {"app_key": ..., "app_secret": ..., "max_req_por_segundo": ..., "rajada": ...}}.
+# Sem OMIE_CONTAS, a unica conta e a "padrao" com OMIE_APP_KEY/OMIE_APP_SECRET.
+OMIE_CONTAS = os.getenv("OMIE_CONTAS", "").strip()
+# Conta usada quando a requisicao nao informa ?conta=; vazio usa a primeira de OMIE_CONTAS
+OMIE_CONTA_PADRAO = os.getenv("OMIE_CONTA_PADRAO", "").strip()
+
+
+def _carregar_contas() -> Dict[str, dict]:
+    if not OMIE_CONTAS:
+        return {CONTA_LEGADA: {"app_key": os.getenv("OMIE_APP_KEY"), "app_secret": os.getenv("OMIE_APP_SECRET")}}
+    contas = json.loads(OMIE_CONTAS)
+    if not isinstance(contas, dict) or not contas:
+        raise ValueError("OMIE_CONTAS deve ser um objeto JSON {conta: {app_key, app_secret}}")
+    return contas
+
+
+def _conta_padrao(contas: Dict[str, dict]) -> str:
+    conta = OMIE_CONTA_PADRAO or next(iter(contas))
+    if conta not in contas:
+        raise ValueError(f"OMIE_CONTA_PADRAO={conta!r} nao esta em OMIE_CONTAS")
+    return conta
+
+
+CONTAS = _carregar_contas()
+CONTA_PADRAO = _conta_padrao(CONTAS)
+
+
+def contas_configuradas() -> List[str]:
+    return list(CONTAS)
@@ -1,17 +1,122 @@
 import sqlite3
+import hashlib
+import json
+import re
+import threading
+import time
 from typing import List, Dict, Optional
 import os
 
+import contas
+from contas import CONTA_LEGADA, CONTA_PADRAO
+from metricas import cronometrado
+
 DB_PATH = os.getenv("DB_PATH", "omie_auth.db")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHED_STATEMENTS = int(os.getenv("SQLITE_CACHED_STATEMENTS", "256"))
+# Parametros por consulta IN (...): abaixo do limite de variaveis do SQLite e poucos formatos
+# de statement distintos para o cache
+SQLITE_LOTE_IN = int(os.getenv("SQLITE_LOTE_IN", "500"))
 
 CREATE_PRODUCTS_SQL = """
 CREATE TABLE IF NOT EXISTS produtos (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
+    conta TEXT NOT NULL DEFAULT 'padrao',
     codigo TEXT,
     descricao TEXT,
     modelo TEXT,
     volumetria TEXT,
-    tamanho_molde TEXT
+    tamanho_molde TEXT,
+    hash TEXT
+);
+"""
+
+# Codigo unico por conta; o indice so por conta (com o rowid implicito) serve a paginacao por id
+CREATE_PRODUCTS_CODIGO_INDEX_SQL = """
+CREATE UNIQUE INDEX IF NOT EXISTS idx_produtos_conta_codigo ON produtos (conta, codigo);
+"""
+
+CREATE_PRODUCTS_CONTA_INDEX_SQL = """
+CREATE INDEX IF NOT EXISTS idx_produtos_conta ON produtos (conta);
+"""
+
+# Indice de texto sobre produtos, mantido pelos triggers abaixo a cada insert/update/delete
+CREATE_PRODUCTS_FTS_SQL = """
+CREATE VIRTUAL TABLE IF NOT EXISTS produtos_fts USING fts5(
+    descricao, modelo, volumetria, tamanho_molde,
+    content='produtos', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+);
+"""
+
+CREATE_PRODUCTS_FTS_TRIGGERS_SQL = """
+CREATE TRIGGER IF NOT EXISTS produtos_fts_ai AFTER INSERT ON produtos BEGIN
+    INSERT INTO produtos_fts (rowid, descricao, modelo, volumetria, tamanho_molde)
+    VALUES (new.id, new.descricao, new.modelo, new.volumetria, new.tamanho_molde);
+END;
+CREATE TRIGGER IF NOT EXISTS produtos_fts_ad AFTER DELETE ON produtos BEGIN
+    INSERT INTO produtos_fts (produtos_fts, rowid, descricao, modelo, volumetria, tamanho_molde)
+    VALUES ('delete', old.id, old.descricao, old.modelo, old.volumetria, old.tamanho_molde);
+END;
+CREATE TRIGGER IF NOT EXISTS produtos_fts_au AFTER UPDATE ON produtos BEGIN
+    INSERT INTO produtos_fts (produtos_fts, rowid, descricao, modelo, volumetria, tamanho_molde)
+    VALUES ('delete', old.id, old.descricao, old.modelo, old.volumetria, old.tamanho_molde);
+    INSERT INTO produtos_fts (rowid, descricao, modelo, volumetria, tamanho_molde)
+    VALUES (new.id, new.descricao, new.modelo, new.volumetria, new.tamanho_molde);
+END;
+"""
+
+CAMPOS_PRODUTO = ("id", "codigo", "descricao", "modelo", "volumetria", "tamanho_molde")
+
+UPSERT_PRODUTO_SQL = """
+INSERT INTO produtos (conta, codigo, descricao, modelo, volumetria, tamanho_molde, hash)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(conta, codigo) DO UPDATE SET
+    descricao = excluded.descricao,
+    modelo = excluded.modelo,
+    volumetria = excluded.volumetria,
+    tamanho_molde = excluded.tamanho_molde,
+    hash = excluded.hash
+WHERE produtos.hash IS NOT excluded.hash
+"""
+
+CREATE_SYNC_STATE_SQL = """
+CREATE TABLE IF NOT EXISTS sync_estado (
+    chave TEXT PRIMARY KEY,
+    valor TEXT
+);
+"""
+
+SALVAR_ESTADO_SQL = """
+INSERT INTO sync_estado (chave, valor) VALUES (?, ?)
+ON CONFLICT(chave) DO UPDATE SET valor = excluded.valor
+"""
+
+# Ultimo agrupamento calculado: um grupo por linha e o grupo de cada produto
+CREATE_GROUPS_SQL = """
+CREATE TABLE IF NOT EXISTS grupos (
+    conta TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    rotulo TEXT,
+    termos TEXT,
+    centroide BLOB,
+    total INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (conta, id)
+);
+CREATE TABLE IF NOT EXISTS produto_grupo (
+    produto_id INTEGER PRIMARY KEY,
+    conta TEXT NOT NULL,
+    grupo_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_produto_grupo_conta_grupo ON produto_grupo (conta, grupo_id, produto_id);
+"""
+
+# Lease entre processos/workers: quem tem a linha dentro do prazo e o dono do lock
+CREATE_LOCKS_SQL = """
+CREATE TABLE IF NOT EXISTS locks (
+    nome TEXT PRIMARY KEY,
+    dono TEXT NOT NULL,
+    expira_em REAL NOT NULL
 );
 """
 
@@ -25,60 +130,347 @@ CREATE TABLE IF NOT EXISTS users (
 """
 
 
-def get_conn():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+# Uma conexao por thread, reaproveitada entre requisicoes (mantem o cache de statements quente)
+_local = threading.local()
+
+
+def nova_conexao():
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False,
+                           timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+                           cached_statements=SQLITE_CACHED_STATEMENTS)
     conn.row_factory = sqlite3.Row
+    # WAL: leitores nao bloqueiam atras da escrita de uma sincronizacao
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    return conn
+
+
+def get_conn():
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.caminho != DB_PATH:
+        if conn is not None:
+            conn.close()
+        conn = nova_conexao()
+        _local.conn = conn
+        _local.caminho = DB_PATH
     return conn
 
 
 def init_db():
     conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(CREATE_PRODUCTS_SQL)
-    cur.execute(CREATE_USERS_SQL)
-    conn.commit()
-    conn.close()
+    with conn:
+        cur = conn.cursor()
+        cur.execute(CREATE_PRODUCTS_SQL)
+        cur.execute(CREATE_USERS_SQL)
+        cur.execute(CREATE_SYNC_STATE_SQL)
+        cur.execute(CREATE_LOCKS_SQL)
+        migrar_grupos_por_conta(cur)
+        for comando in CREATE_GROUPS_SQL.split(";")[:-1]:
+            cur.execute(comando)
+        migrar_produtos_unicos(cur)
+        realocar_conta_legada(cur, CONTA_PADRAO, contas.contas_configuradas())
+        criar_indice_texto(cur)
 
 
-def salvar_produtos(produtos: List[Dict]):
-    conn = get_conn()
-    cur = conn.cursor()
-    for p in produtos:
-        cur.execute("""
-            INSERT INTO produtos (codigo, descricao, modelo, volumetria, tamanho_molde)
-            VALUES (?, ?, ?, ?, ?)
-        """, (
-            p.get("codigo_produto", ""),
-            p.get("descricao", ""),
-            p.get("modelo", ""),
-            p.get("volumetria", ""),
-            p.get("tamanho_molde", "")
-        ))
-    conn.commit()
-    conn.close()
-
-
-def buscar_todos_produtos():
+def migrar_produtos_unicos(cur):
+    # Bancos antigos: sem coluna hash/conta e com o catalogo duplicado a cada sincronizacao
+    colunas = {r["name"] for r in cur.execute("PRAGMA table_info(produtos)")}
+    if "hash" not in colunas:
+        cur.execute("ALTER TABLE produtos ADD COLUMN hash TEXT")
+    if "conta" not in colunas:
+        # Tudo o que ja estava no banco pertence a conta legada (ver realocar_conta_legada)
+        cur.execute(f"ALTER TABLE produtos ADD COLUMN conta TEXT NOT NULL DEFAULT '{CONTA_LEGADA}'")
+    cur.execute(CREATE_PRODUCTS_CONTA_INDEX_SQL)
+    cur.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name IN "
+                "('idx_produtos_codigo', 'idx_produtos_conta_codigo')")
+    indices = {r["name"] for r in cur.fetchall()}
+    if "idx_produtos_conta_codigo" in indices:
+        return
+    if not indices:
+        # Mantem a copia mais recente de cada codigo
+        cur.execute("DELETE FROM produtos WHERE id NOT IN (SELECT MAX(id) FROM produtos GROUP BY codigo)")
+    # Unico por codigo vira unico por (conta, codigo)
+    cur.execute("DROP INDEX IF EXISTS idx_produtos_codigo")
+    cur.execute(CREATE_PRODUCTS_CODIGO_INDEX_SQL)
+
+
+def realocar_conta_legada(cur, conta_padrao: str, configuradas: List[str]):
+    # Os dados de antes de OMIE_CONTAS estao na conta "padrao". Se ela nao e mais uma conta
+    # configurada, passam para a conta padrao, enquanto esta ainda nao tem produtos proprios
+    if CONTA_LEGADA in configuradas:
+        return
+    cur.execute("SELECT 1 FROM produtos WHERE conta = ? LIMIT 1", (conta_padrao,))
+    if cur.fetchone() is not None:
+        return
+    for tabela in ("produtos", "grupos", "produto_grupo"):
+        cur.execute(f"UPDATE {tabela} SET conta = ? WHERE conta = ?", (conta_padrao, CONTA_LEGADA))
+    # Marca d'agua, checkpoint, versao e agrupamento da conta legada (chaves sem sufixo)
+    cur.execute("UPDATE OR IGNORE sync_estado SET chave = chave || ':' || ? WHERE instr(chave, ':') = 0",
+                (conta_padrao,))
+
+
+def migrar_grupos_por_conta(cur):
+    # Agrupamentos gravados antes das contas sao descartados (sao recalculados por /agrupar)
+    colunas = {r["name"] for r in cur.execute("PRAGMA table_info(grupos)")}
+    if colunas and "conta" not in colunas:
+        cur.execute("DROP TABLE grupos")
+        cur.execute("DROP TABLE IF EXISTS produto_grupo")
+        cur.execute("DELETE FROM sync_estado WHERE chave = 'agrupamento'")
+
+
+def criar_indice_texto(cur):
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'produtos_fts'")
+    existia = cur.fetchone() is not None
+    cur.execute(CREATE_PRODUCTS_FTS_SQL)
+    for trigger in CREATE_PRODUCTS_FTS_TRIGGERS_SQL.split("END;")[:-1]:
+        cur.execute(trigger + "END;")
+    if not existia:
+        # Indexa os produtos que ja estavam no banco antes do FTS existir
+        cur.execute("INSERT INTO produtos_fts (produtos_fts) VALUES ('rebuild')")
+
+
+def chave_conta(chave: str, conta: str) -> str:
+    # Chaves de sync_estado/locks por conta; a conta "padrao" mantem os nomes de antes das contas
+    return chave if conta == CONTA_LEGADA else f"{chave}:{conta}"
+
+
+def _linha_produto(p: Dict, conta: str) -> tuple:
+    valores = (
+        str(p.get("codigo_produto", "")),
+        p.get("descricao", ""),
+        p.get("modelo", ""),
+        p.get("volumetria", ""),
+        p.get("tamanho_molde", "")
+    )
+    conteudo = "\x1f".join(str(v) for v in valores)
+    return (conta,) + valores + (hashlib.sha1(conteudo.encode("utf-8")).hexdigest(),)
+
+
+@cronometrado("salvar_produtos")
+def salvar_produtos(produtos: List[Dict], estado: Optional[Dict[str, str]] = None,
+                    conta: str = CONTA_PADRAO) -> int:
+    """Upsert em lote por codigo; linhas com o mesmo hash de conteudo nao sao regravadas.
+
+    `estado` (chave -> valor em sync_estado) e gravado na mesma transacao, p.ex. o checkpoint
+    da sincronizacao. Retorna a quantidade de produtos inseridos ou alterados.
+    """
     conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM produtos")
-    rows = cur.fetchall()
-    conn.close()
+    with conn:
+        if estado:
+            conn.executemany(SALVAR_ESTADO_SQL, estado.items())
+        # rowcount soma apenas as linhas de produtos (ignora as escritas dos triggers do FTS)
+        cur = conn.executemany(UPSERT_PRODUTO_SQL, (_linha_produto(p, conta) for p in produtos))
+        gravados = max(cur.rowcount, 0)
+        if gravados:
+            # Nova versao do catalogo invalida os resultados derivados (ex.: agrupamento)
+            conn.execute("""
+                INSERT INTO sync_estado (chave, valor) VALUES (?, '1')
+                ON CONFLICT(chave) DO UPDATE SET valor = CAST(valor AS INTEGER) + 1
+            """, (chave_conta("versao_catalogo", conta),))
+    return gravados
+
+
+def buscar_todos_produtos(conta: str = CONTA_PADRAO):
+    rows = get_conn().execute("SELECT * FROM produtos WHERE conta = ?", (conta,)).fetchall()
     produtos = [dict(r) for r in rows]
     return produtos
 
-def create_user(username: str, hashed_password: str):
+
+def campos_projecao(campos: Optional[List[str]]) -> List[str]:
+    # Projecao validada contra a lista fixa de colunas; o id sempre volta por ser o cursor
+    if not campos:
+        return list(CAMPOS_PRODUTO)
+    invalidos = [c for c in campos if c not in CAMPOS_PRODUTO]
+    if invalidos:
+        raise ValueError(f"Campos invalidos: {', '.join(invalidos)}")
+    return ["id"] + [c for c in CAMPOS_PRODUTO if c in campos and c != "id"]
+
+
+def _colunas(campos: Optional[List[str]]) -> str:
+    return ", ".join(campos_projecao(campos))
+
+
+@cronometrado("ler_catalogo")
+def ler_catalogo(conta: str = CONTA_PADRAO) -> tuple:
+    """(versao_catalogo, linhas ordenadas por id) lidos na mesma transacao de leitura."""
     conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("INSERT INTO users (username, hashed_password) VALUES (?, ?)", (username, hashed_password))
-    conn.commit()
-    conn.close()
+    conn.execute("BEGIN")
+    try:
+        versao = versao_catalogo(conta)
+        rows = conn.execute(f"SELECT {', '.join(CAMPOS_PRODUTO)}, hash FROM produtos WHERE conta = ? ORDER BY id",
+                            (conta,)).fetchall()
+    finally:
+        conn.commit()
+    return versao, [tuple(r) for r in rows]
 
 
-def get_user_by_username(username: str) -> Optional[Dict]:
+def buscar_produtos_por_codigos(codigos: List[str], campos: Optional[List[str]] = None,
+                                conta: str = CONTA_PADRAO) -> Dict[str, Dict]:
+    """Produtos por codigo (codigo -> produto), em consultas IN de ate SQLITE_LOTE_IN codigos."""
+    lista = campos_projecao(campos)
+    colunas = lista if "codigo" in lista else lista + ["codigo"]
+    unicos = list(dict.fromkeys(codigos))
+    encontrados = {}
     conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM users WHERE username = ?", (username,))
-    row = cur.fetchone()
-    conn.close()
-    return dict(row) if row else None
\ No newline at end of file
+    for inicio in range(0, len(unicos), SQLITE_LOTE_IN):
+        lote = unicos[inicio:inicio + SQLITE_LOTE_IN]
+        # Usa o indice unico idx_produtos_conta_codigo
+        rows = conn.execute(
+            f"SELECT {', '.join(colunas)} FROM produtos "
+            f"WHERE conta = ? AND codigo IN ({', '.join('?' * len(lote))})",
+            [conta] + lote,
+        ).fetchall()
+        for r in rows:
+            encontrados[r["codigo"]] = {c: r[c] for c in lista}
+    return encontrados
+
+
+def _expressao_busca(consulta: str) -> str:
+    # Cada palavra vira um prefixo entre aspas: evita que a sintaxe do FTS5 vaze para o usuario
+    termos = re.findall(r"\w+", consulta)
+    return " ".join(f'"{t}"*' for t in termos)
+
+
+def buscar_produtos_texto(consulta: str, limite: int = 20, offset: int = 0,
+                          conta: str = CONTA_PADRAO) -> List[Dict]:
+    expressao = _expressao_busca(consulta)
+    if not expressao:
+        return []
+    rows = get_conn().execute(f"""
+        SELECT {", ".join("p." + c for c in CAMPOS_PRODUTO)}, bm25(produtos_fts) AS relevancia
+        FROM produtos_fts JOIN produtos p ON p.id = produtos_fts.rowid
+        WHERE produtos_fts MATCH ? AND p.conta = ?
+        ORDER BY relevancia
+        LIMIT ? OFFSET ?
+    """, (expressao, conta, limite, offset)).fetchall()
+    return [dict(r) for r in rows]
+
+
+def salvar_agrupamento(grupos: List[Dict], atribuicoes, metadados: Dict, conta: str = CONTA_PADRAO):
+    """Substitui o agrupamento persistido numa unica transacao (leitores veem o antigo ou o novo)."""
+    with get_conn() as conn:
+        conn.execute("DELETE FROM produto_grupo WHERE conta = ?", (conta,))
+        conn.execute("DELETE FROM grupos WHERE conta = ?", (conta,))
+        conn.executemany(
+            "INSERT INTO grupos (conta, id, rotulo, termos, centroide, total) VALUES (?, ?, ?, ?, ?, ?)",
+            ((conta, g["id"], g["rotulo"], json.dumps(g["termos"], ensure_ascii=False), g["centroide"], g["total"])
+             for g in grupos),
+        )
+        conn.executemany("INSERT INTO produto_grupo (produto_id, conta, grupo_id) VALUES (?, ?, ?)",
+                         ((produto_id, conta, grupo_id) for produto_id, grupo_id in atribuicoes))
+        conn.execute(SALVAR_ESTADO_SQL, (chave_conta("agrupamento", conta), json.dumps(metadados)))
+
+
+def obter_agrupamento(conta: str = CONTA_PADRAO) -> Optional[Dict]:
+    # Parametros e versao do catalogo do agrupamento persistido (None se nunca foi calculado)
+    valor = obter_estado(chave_conta("agrupamento", conta))
+    return json.loads(valor) if valor else None
+
+
+def _grupo(row) -> Dict:
+    grupo = dict(row)
+    grupo["termos"] = json.loads(grupo["termos"] or "[]")
+    return grupo
+
+
+def listar_grupos(conta: str = CONTA_PADRAO) -> List[Dict]:
+    rows = get_conn().execute("SELECT id, rotulo, termos, total FROM grupos WHERE conta = ? ORDER BY id",
+                              (conta,)).fetchall()
+    return [_grupo(r) for r in rows]
+
+
+def buscar_grupo(grupo_id: int, conta: str = CONTA_PADRAO) -> Optional[Dict]:
+    row = get_conn().execute("SELECT id, rotulo, termos, total FROM grupos WHERE conta = ? AND id = ?",
+                             (conta, grupo_id)).fetchone()
+    return _grupo(row) if row else None
+
+
+def buscar_produtos_grupo(grupo_id: int, apos_id: int = 0, limite: int = 100,
+                          campos: Optional[List[str]] = None, conta: str = CONTA_PADRAO) -> List[Dict]:
+    colunas = ", ".join("p." + c for c in _colunas(campos).split(", "))
+    rows = get_conn().execute(f"""
+        SELECT {colunas} FROM produto_grupo pg JOIN produtos p ON p.id = pg.produto_id
+        WHERE pg.conta = ? AND pg.grupo_id = ? AND pg.produto_id > ?
+        ORDER BY pg.produto_id LIMIT ?
+    """, (conta, grupo_id, apos_id, limite)).fetchall()
+    return [dict(r) for r in rows]
+
+
+def buscar_grupo_produto(codigo: str, conta: str = CONTA_PADRAO) -> Optional[Dict]:
+    row = get_conn().execute("""
+        SELECT g.id, g.rotulo, g.termos, g.total FROM produtos p
+        JOIN produto_grupo pg ON pg.produto_id = p.id
+        JOIN grupos g ON g.conta = pg.conta AND g.id = pg.grupo_id
+        WHERE p.conta = ? AND p.codigo = ?
+    """, (conta, codigo)).fetchone()
+    return _grupo(row) if row else None
+
+
+def versao_catalogo(conta: str = CONTA_PADRAO) -> int:
+    return int(obter_estado(chave_conta("versao_catalogo", conta)) or 0)
+
+
+def obter_estado(chave: str) -> Optional[str]:
+    row = get_conn().execute("SELECT valor FROM sync_estado WHERE chave = ?", (chave,)).fetchone()
+    return row["valor"] if row else None
+
+
+def salvar_estado(chave: str, valor: str):
+    with get_conn() as conn:
+        conn.execute(SALVAR_ESTADO_SQL, (chave, valor))
+
+
+def remover_estado(chave: str):
+    with get_conn() as conn:
+        conn.execute("DELETE FROM sync_estado WHERE chave = ?", (chave,))
+
+
+def adquirir_lock(nome: str, dono: str, duracao: float) -> bool:
+    # Um unico statement: o SQLite garante que so um processo vence a disputa
+    agora = time.time()
+    with get_conn() as conn:
+        cur = conn.execute("""
+            INSERT INTO locks (nome, dono, expira_em) VALUES (?, ?, ?)
+            ON CONFLICT(nome) DO UPDATE SET dono = excluded.dono, expira_em = excluded.expira_em
+            WHERE locks.expira_em < ? OR locks.dono = excluded.dono
+        """, (nome, dono, agora + duracao, agora))
+        return cur.rowcount == 1
+
+
+def renovar_lock(nome: str, dono: str, duracao: float) -> bool:
+    with get_conn() as conn:
+        cur = conn.execute("UPDATE locks SET expira_em = ? WHERE nome = ? AND dono = ?",
+                           (time.time() + duracao, nome, dono))
+        return cur.rowcount == 1
+
+
+def liberar_lock(nome: str, dono: str):
+    with get_conn() as conn:
+        conn.execute("DELETE FROM locks WHERE nome = ? AND dono = ?", (nome, dono))
+
+
+def dono_lock(nome: str) -> Optional[str]:
+    row = get_conn().execute("SELECT dono FROM locks WHERE nome = ? AND expira_em >= ?",
+                             (nome, time.time())).fetchone()
+    return row["dono"] if row else None
+
+
+def create_user(username: str, hashed_password: str):
+    with get_conn() as conn:
+        conn.execute("INSERT INTO users (username, hashed_password) VALUES (?, ?)", (username, hashed_password))
+
+
+def get_user_by_username(username: str) -> Optional[Dict]:
+    row = get_conn().execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()
+    return dict(row) if row else None
+
+
+def set_user_active(username: str, active: bool):
+    with get_conn() as conn:
+        conn.execute("UPDATE users SET is_active = ? WHERE username = ?", (1 if active else 0, username))
+
+
+def update_user_password(username: str, hashed_password: str):
+    with get_conn() as conn:
+        conn.execute("UPDATE users SET hashed_password = ? WHERE username = ?", (hashed_password, username))
@@ -1,27 +1,357 @@
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.cluster import KMeans
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Optional
 
+# scikit-learn, numpy e joblib sao importados dentro das funcoes: importar este modulo
+# (main, sincronizacao) nao paga o custo de carregar a pilha cientifica.
 
-def agrupar_produtos(produtos):
+from cache import CacheTTL
+from metricas import cronometrado
+from catalogo import obter_catalogo
+from database import salvar_agrupamento, CAMPOS_PRODUTO, CONTA_PADRAO
+from contas import CONTA_LEGADA
+
+# O scikit-learn so traz stop words em ingles; lista curta para as descricoes do catalogo
+STOP_WORDS_PT = [
+    "a", "o", "as", "os", "um", "uma", "de", "da", "do", "das", "dos", "e", "em", "no", "na",
+    "nos", "nas", "para", "por", "com", "sem", "ao", "aos", "c", "p",
+]
+
+AGRUPAMENTO_CACHE_ITENS = int(os.getenv("AGRUPAMENTO_CACHE_ITENS", "8"))
+AGRUPAMENTO_MODO = os.getenv("AGRUPAMENTO_MODO", "completo")
+# Maior n_clusters aceito em /agrupar (o custo do KMeans cresce com k x AGRUPAMENTO_N_INIT)
+AGRUPAMENTO_CLUSTERS_MAXIMO = int(os.getenv("AGRUPAMENTO_CLUSTERS_MAXIMO", "100"))
+
+# Modo incremental: vectorizer e MiniBatchKMeans persistidos entre execucoes
+MODELO_IA_PATH = os.getenv("MODELO_IA_PATH", "modelo_agrupamento.joblib")
+AGRUPAMENTO_K_MAX = int(os.getenv("AGRUPAMENTO_K_MAX", "20"))
+AGRUPAMENTO_AMOSTRA_SILHUETA = int(os.getenv("AGRUPAMENTO_AMOSTRA_SILHUETA", "2000"))
+# Acima desta fracao de produtos novos/alterados o vocabulario e o modelo sao refeitos
+AGRUPAMENTO_FRACAO_RETREINO = float(os.getenv("AGRUPAMENTO_FRACAO_RETREINO", "0.3"))
+AGRUPAMENTO_LOTE = 1024
+# Termos de maior peso no centroide guardados como rotulo de cada grupo
+AGRUPAMENTO_TERMOS = int(os.getenv("AGRUPAMENTO_TERMOS", "5"))
+
+# KMeans completo roda num pool de processos proprio: cada reinicio (n_init) vai para um processo,
+# fora do GIL dos workers da API. 0 processos = roda no proprio processo, como antes.
+# Cada worker do uvicorn tem o seu pool: ajuste para processos x workers <= nucleos.
+AGRUPAMENTO_PROCESSOS = int(os.getenv("AGRUPAMENTO_PROCESSOS", "4"))
+AGRUPAMENTO_N_INIT = int(os.getenv("AGRUPAMENTO_N_INIT", "10"))
+# Threads de BLAS/OpenMP por processo do pool (processos x threads <= nucleos)
+AGRUPAMENTO_THREADS = int(os.getenv("AGRUPAMENTO_THREADS", "1"))
+# Prioridade menor que a da API (os.nice) para nao disputar CPU com as requisicoes
+AGRUPAMENTO_NICE = int(os.getenv("AGRUPAMENTO_NICE", "10"))
+# Passado esse tempo devolve o ultimo resultado bom para os mesmos parametros
+AGRUPAMENTO_TIMEOUT = float(os.getenv("AGRUPAMENTO_TIMEOUT", "300"))
+
+# Resultados por (conta, versao do catalogo, parametros); uma sincronizacao que altera dados muda a versao
+_cache_agrupamento = CacheTTL(max_itens=AGRUPAMENTO_CACHE_ITENS, nome="agrupamento")
+# Um calculo por vez em cada conta; contas diferentes agrupam em paralelo
+_locks_agrupamento = {}
+_lock_agrupamento = threading.Lock()
+# Ultimo resultado calculado por (conta, n_clusters, modo), usado quando um novo calculo estoura o
+# timeout; limitado como o cache acima (cada resultado e uma copia do catalogo agrupado)
+_ultimos_resultados = CacheTTL(max_itens=AGRUPAMENTO_CACHE_ITENS)
+
+_pool = None
+_lock_pool = threading.Lock()
+
+
+def _texto(p) -> str:
+    return f"{p.get('descricao','')} {p.get('modelo','')} {p.get('volumetria','')} {p.get('tamanho_molde','')}"
+
+
+def _montar_grupos(labels, produtos, campos=None) -> dict:
+    # `campos` projeta cada produto (p.ex. sem o hash interno do catalogo)
+    grupos = {}
+    for label, produto in zip(labels, produtos):
+        chave = f"grupo_{label+1}"
+        grupos.setdefault(chave, []).append({c: produto[c] for c in campos} if campos else produto)
+    return grupos
+
+
+def _termos_centroides(centroides, nomes) -> list:
+    import numpy as np
+    principais = np.argsort(-centroides, axis=1)[:, :AGRUPAMENTO_TERMOS]
+    return [[str(nomes[i]) for i in linha if centroides[k, i] > 0] for k, linha in enumerate(principais)]
+
+
+def agrupar_produtos(produtos, n_clusters: Optional[int] = None, modo: str = "completo"):
     if not produtos:
         return {}
+    return _montar_grupos(calcular_agrupamento(produtos, n_clusters, modo)["labels"], produtos)
 
-    textos = [
-        f"{p.get('descricao','')} {p.get('modelo','')} {p.get('volumetria','')} {p.get('tamanho_molde','')}"
-        for p in produtos
-    ]
 
-    vectorizer = TfidfVectorizer(stop_words='portuguese')
-    X = vectorizer.fit_transform(textos)
+@cronometrado("agrupar_produtos")
+def calcular_agrupamento(produtos, n_clusters: Optional[int] = None, modo: str = "completo",
+                         conta: str = CONTA_PADRAO) -> dict:
+    """Retorna labels (na ordem de `produtos`), centroides e os termos principais de cada grupo."""
+    if modo == "incremental":
+        return agrupar_incremental(produtos, n_clusters, conta)
+
+    textos = [_texto(p) for p in produtos]
 
     # Determine clusters conservatively
-    n_clusters = max(2, min(8, max(2, len(produtos) // 10)))
-    kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=10)
+    if n_clusters is None:
+        n_clusters = max(2, min(8, max(2, len(produtos) // 10)))
+    n_clusters = min(n_clusters, len(produtos))
+    sementes = [42 + i for i in range(AGRUPAMENTO_N_INIT)]
+
+    if AGRUPAMENTO_PROCESSOS <= 0:
+        X, nomes = _vetorizar(textos)
+        reinicios = [_reiniciar_kmeans(X, n_clusters, s) for s in sementes]
+    else:
+        limite = time.monotonic() + AGRUPAMENTO_TIMEOUT
+        pool = _obter_pool()
+        try:
+            X, nomes = pool.submit(_vetorizar, textos).result(timeout=AGRUPAMENTO_TIMEOUT)
+            futuros = [pool.submit(_reiniciar_kmeans, X, n_clusters, s) for s in sementes]
+            reinicios = [f.result(timeout=max(0.0, limite - time.monotonic())) for f in futuros]
+        except TimeoutError:
+            _reciclar_pool(pool)
+            raise
+
+    # Mesmo criterio do n_init do scikit-learn: fica o reinicio de menor inercia
+    _, labels, centroides = min(reinicios, key=lambda r: r[0])
+    return {"labels": labels, "centroides": centroides, "termos": _termos_centroides(centroides, nomes)}
+
+
+def _vetorizar(textos):
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    vectorizer = TfidfVectorizer(stop_words=STOP_WORDS_PT)
+    X = vectorizer.fit_transform(textos)
+    return X, vectorizer.get_feature_names_out()
+
+
+def _reiniciar_kmeans(X, n_clusters: int, semente: int) -> tuple:
+    from sklearn.cluster import KMeans
+    kmeans = KMeans(n_clusters=n_clusters, random_state=semente, n_init=1)
     labels = kmeans.fit_predict(X)
+    return kmeans.inertia_, labels, kmeans.cluster_centers_
+
+
+def _iniciar_processo(threads: int, nice: int):
+    # Roda antes de qualquer import do numpy no processo filho (contexto spawn)
+    for variavel in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[variavel] = str(threads)
+    if nice:
+        try:
+            os.nice(nice)
+        except (AttributeError, OSError):
+            pass
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+    threadpool_limits(limits=threads)
+
+
+def _obter_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _lock_pool:
+        if _pool is None:
+            import multiprocessing
+            # spawn: o filho nao herda threads/locks do servidor (fork com threads ativas pode travar)
+            _pool = ProcessPoolExecutor(max_workers=AGRUPAMENTO_PROCESSOS,
+                                        mp_context=multiprocessing.get_context("spawn"),
+                                        initializer=_iniciar_processo,
+                                        initargs=(AGRUPAMENTO_THREADS, AGRUPAMENTO_NICE))
+        return _pool
+
+
+def _reciclar_pool(pool: ProcessPoolExecutor):
+    # Reinicios ja em execucao nao podem ser cancelados: o pool e descartado (os pendentes sao
+    # cancelados e os processos saem ao terminar a tarefa atual) e o proximo calculo sobe outro
+    global _pool
+    with _lock_pool:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def encerrar_processos():
+    global _pool
+    with _lock_pool:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def escolher_k(X, k_max: int = AGRUPAMENTO_K_MAX) -> int:
+    import numpy as np
+    from sklearn.cluster import MiniBatchKMeans
+    from sklearn.metrics import silhouette_score
+
+    # Silhueta calculada sobre uma amostra: o custo nao cresce com o catalogo
+    n = X.shape[0]
+    k_max = min(k_max, n - 1)
+    if k_max <= 2:
+        return 2
+    if n > AGRUPAMENTO_AMOSTRA_SILHUETA:
+        rng = np.random.default_rng(42)
+        X = X[rng.choice(n, AGRUPAMENTO_AMOSTRA_SILHUETA, replace=False)]
+    melhor_k, melhor = 2, -1.0
+    for k in range(2, k_max + 1):
+        labels = MiniBatchKMeans(n_clusters=k, random_state=42, n_init=3,
+                                 batch_size=AGRUPAMENTO_LOTE).fit_predict(X)
+        if len(set(labels)) < 2:
+            continue
+        score = silhouette_score(X, labels)
+        if score > melhor:
+            melhor_k, melhor = k, score
+    return melhor_k
+
+
+def treinar_modelo(produtos, n_clusters: Optional[int] = None) -> dict:
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.cluster import MiniBatchKMeans
+
+    vectorizer = TfidfVectorizer(stop_words=STOP_WORDS_PT)
+    X = vectorizer.fit_transform([_texto(p) for p in produtos])
+    # escolher_k devolve pelo menos 2; catalogos minusculos ficam com um grupo por produto
+    k = min(n_clusters or escolher_k(X), X.shape[0])
+    modelo = MiniBatchKMeans(n_clusters=k, random_state=42, n_init=3, batch_size=AGRUPAMENTO_LOTE)
+    modelo.fit(X)
+    return {
+        "vectorizer": vectorizer,
+        "modelo": modelo,
+        "n_clusters_pedido": n_clusters,
+        "hashes": {p["codigo"]: p.get("hash") for p in produtos},
+    }
+
+
+def caminho_modelo(conta: str = CONTA_PADRAO) -> str:
+    # modelo_agrupamento.joblib para a conta "padrao" (como database.chave_conta), para o arquivo
+    # nao mudar de dono quando OMIE_CONTA_PADRAO mudar; modelo_agrupamento.<conta>.joblib para as demais
+    if conta == CONTA_LEGADA:
+        return MODELO_IA_PATH
+    base, extensao = os.path.splitext(MODELO_IA_PATH)
+    return f"{base}.{conta}{extensao}"
+
+
+def carregar_modelo(conta: str = CONTA_PADRAO) -> Optional[dict]:
+    caminho = caminho_modelo(conta)
+    if not os.path.exists(caminho):
+        return None
+    import joblib
+    try:
+        return joblib.load(caminho)
+    except Exception:
+        return None
+
+
+def salvar_modelo(estado: dict, conta: str = CONTA_PADRAO):
+    import joblib
+    caminho = caminho_modelo(conta)
+    temporario = caminho + ".tmp"
+    joblib.dump(estado, temporario)
+    os.replace(temporario, caminho)
+
+
+def agrupar_incremental(produtos, n_clusters: Optional[int] = None, conta: str = CONTA_PADRAO):
+    estado = carregar_modelo(conta)
+    alterados = []
+    if estado is not None and estado["n_clusters_pedido"] == n_clusters:
+        hashes = estado["hashes"]
+        alterados = [p for p in produtos if hashes.get(p["codigo"]) != p.get("hash")]
+        if len(alterados) > AGRUPAMENTO_FRACAO_RETREINO * len(produtos):
+            estado = None
+
+    if estado is None or estado["n_clusters_pedido"] != n_clusters:
+        estado = treinar_modelo(produtos, n_clusters)
+        salvar_modelo(estado, conta)
+    elif alterados:
+        # Incorpora apenas os produtos novos/alterados nos centroides existentes
+        X_alterados = estado["vectorizer"].transform([_texto(p) for p in alterados])
+        estado["modelo"].partial_fit(X_alterados)
+        estado["hashes"].update({p["codigo"]: p.get("hash") for p in alterados})
+        salvar_modelo(estado, conta)
+
+    vectorizer, modelo = estado["vectorizer"], estado["modelo"]
+    labels = []
+    for inicio in range(0, len(produtos), AGRUPAMENTO_LOTE):
+        lote = produtos[inicio:inicio + AGRUPAMENTO_LOTE]
+        labels.extend(modelo.predict(vectorizer.transform([_texto(p) for p in lote])))
+    return {"labels": labels, "centroides": modelo.cluster_centers_,
+            "termos": _termos_centroides(modelo.cluster_centers_, vectorizer.get_feature_names_out())}
+
+
+def pre_carregar():
+    """Importa a pilha de agrupamento antecipadamente (aquecimento opcional no startup)."""
+    import joblib  # noqa: F401
+    from sklearn.cluster import KMeans, MiniBatchKMeans  # noqa: F401
+    from sklearn.feature_extraction.text import TfidfVectorizer  # noqa: F401
+    from sklearn.metrics import silhouette_score  # noqa: F401
+    if AGRUPAMENTO_PROCESSOS > 0:
+        # Sobe os processos do pool ja com a pilha importada
+        pool = _obter_pool()
+        for _ in range(AGRUPAMENTO_PROCESSOS):
+            pool.submit(_importar_pilha)
+
+
+def _importar_pilha():
+    from sklearn.cluster import KMeans  # noqa: F401
+    from sklearn.feature_extraction.text import TfidfVectorizer  # noqa: F401
+
+
+def _lock_conta(conta: str) -> threading.Lock:
+    with _lock_agrupamento:
+        return _locks_agrupamento.setdefault(conta, threading.Lock())
+
+
+def agrupar_catalogo(n_clusters: Optional[int] = None, modo: str = AGRUPAMENTO_MODO,
+                     progresso: Optional[Callable] = None, conta: str = CONTA_PADRAO) -> dict:
+    progresso = progresso or (lambda **_: None)
+    catalogo = obter_catalogo(conta, verificar=True)
+    chave = (conta, catalogo.versao, n_clusters, modo)
+    resultado = _cache_agrupamento.get(chave)
+    if resultado is not None:
+        progresso(etapa="cache")
+        return resultado
+    # Uma unica execucao por vez: chamadas simultaneas esperam e reaproveitam o resultado
+    with _lock_conta(conta):
+        resultado = _cache_agrupamento.get(chave)
+        if resultado is None:
+            produtos = catalogo.registros()
+            progresso(etapa="agrupando", produtos=len(produtos))
+            try:
+                calculo = calcular_agrupamento(produtos, n_clusters, modo, conta) if produtos else None
+            except TimeoutError:
+                anterior = _ultimos_resultados.get((conta, n_clusters, modo))
+                if anterior is None:
+                    raise
+                # Nao entra no cache: a proxima chamada tenta calcular de novo
+                progresso(etapa="timeout")
+                return {**anterior, "desatualizado": True}
+            grupos = _montar_grupos(calculo["labels"], produtos, CAMPOS_PRODUTO) if calculo else {}
+            if calculo:
+                persistir_agrupamento(calculo, produtos, chave)
+            resultado = {"total_grupos": len(grupos), "grupos": grupos}
+            _cache_agrupamento.set(chave, resultado)
+            _ultimos_resultados.set((conta, n_clusters, modo), resultado)
+    progresso(etapa="concluido")
+    return resultado
+
+
+def persistir_agrupamento(calculo: dict, produtos, chave: tuple):
+    import numpy as np
+    conta, versao, n_clusters, modo = chave
+    labels = [int(label) for label in calculo["labels"]]
+    totais = np.bincount(labels, minlength=len(calculo["centroides"]))
+    grupos = [{
+        "id": k + 1,
+        "rotulo": " ".join(termos[:3]),
+        "termos": termos,
+        "centroide": np.asarray(centroide, dtype=np.float32).tobytes(),
+        "total": int(totais[k]),
+    } for k, (centroide, termos) in enumerate(zip(calculo["centroides"], calculo["termos"]))]
+    # Mesma numeracao de /agrupar (grupo_1, grupo_2...)
+    atribuicoes = ((p["id"], label + 1) for p, label in zip(produtos, labels))
+    salvar_agrupamento(grupos, atribuicoes,
+                       {"versao_catalogo": versao, "n_clusters": n_clusters, "modo": modo}, conta)
 
-    grupos = {}
-    for label, produto in zip(labels, produtos):
-        chave = f"grupo_{label+1}"
-        grupos.setdefault(chave, []).append(produto)
 
-    return grupos
\ No newline at end of file
+def invalidar_agrupamento():
+    _cache_agrupamento.limpar()
@@ -1,52 +1,131 @@
 import os
+import asyncio
+import time
+from contextlib import asynccontextmanager
 import fastapi
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from pydantic import BaseModel
-from typing import List
+from pydantic import BaseModel, Field
+from typing import List, Optional, Union
 from datetime import timedelta
 
-from omie_api import get_produtos
-from database import init_db, salvar_produtos, buscar_todos_produtos, create_user, get_user_by_username
-from auth import get_password_hash, verify_password, create_access_token, decode_access_token
-from ai_clustering import agrupar_produtos
+from database import (init_db, buscar_produtos_texto, versao_catalogo, create_user, get_user_by_username,
+                      update_user_password, obter_agrupamento, listar_grupos, buscar_grupo,
+                      buscar_produtos_grupo, buscar_grupo_produto, buscar_produtos_por_codigos, CONTA_PADRAO)
+from autenticacao import (get_password_hash_async, verify_and_update_password_async, create_access_token,
+                          decode_access_token_cached, get_active_user, get_cached_user, invalidate_user)
+from enumeracaoIA import (agrupar_catalogo, pre_carregar, encerrar_processos, AGRUPAMENTO_MODO,
+                          AGRUPAMENTO_CLUSTERS_MAXIMO)
+from similares import buscar_similares, SIMILARES_K_PADRAO, SIMILARES_K_MAXIMO
+from contas import contas_configuradas
+import agendador
+from catalogo import obter_catalogo
+from tarefas import submeter, obter_tarefa, tarefa_ativa, FALHOU
+import metricas
+from respostas import (RespostaJSONRapida, configurar_compressao, etag_catalogo,
+                       nao_modificado, resposta_304, com_etag)
 
-# init database
-init_db()
+PRODUTOS_LIMITE_PADRAO = int(os.getenv("PRODUTOS_LIMITE_PADRAO", "100"))
+PRODUTOS_LIMITE_MAXIMO = int(os.getenv("PRODUTOS_LIMITE_MAXIMO", "1000"))
+PRODUTOS_LOTE_MAXIMO = int(os.getenv("PRODUTOS_LOTE_MAXIMO", "5000"))
+# Logins simultaneos (cada um custa um bcrypt); o excedente espera ate LOGIN_ESPERA_MAX segundos e recebe 429
+LOGIN_MAX_CONCORRENTES = int(os.getenv("LOGIN_MAX_CONCORRENTES", "4"))
+LOGIN_ESPERA_MAX = float(os.getenv("LOGIN_ESPERA_MAX", "5"))
 
-app = FastAPI(title="Omie + IA + JWT Backend")
+# Importa o scikit-learn em segundo plano no startup em vez de na primeira chamada a /agrupar
+PRELOAD_IA = os.getenv("PRELOAD_IA", "0") == "1"
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # init database
+    await run_in_threadpool(init_db)
+    if PRELOAD_IA:
+        asyncio.get_running_loop().run_in_executor(None, pre_carregar)
+    # Sincronizacao periodica (SYNC_CRON / SYNC_INTERVALO_MINUTOS); cada worker tem o seu laco,
+    # o lease no banco garante uma execucao por vez
+    agendador.validar_configuracao()
+    agendamento = asyncio.create_task(agendador.executar())
+    yield
+    agendamento.cancel()
+    encerrar_processos()
+
+
+app = FastAPI(title="Omie + IA + JWT Backend", lifespan=lifespan)
+configurar_compressao(app)
 
 # OAuth2 scheme - tokenUrl should be the path relative to the app (no leading slash required)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+_login_semaforo = asyncio.Semaphore(LOGIN_MAX_CONCORRENTES)
+
+
+@app.middleware("http")
+async def medir_requisicoes(request: Request, call_next):
+    metricas.HTTP_EM_ANDAMENTO.inc(metodo=request.method)
+    inicio = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        metricas.HTTP_EM_ANDAMENTO.dec(metodo=request.method)
+        # Rota como template (/jobs/{id_tarefa}) para nao criar uma serie por URL
+        rota = request.scope.get("route")
+        metricas.HTTP_DURACAO.observar(time.perf_counter() - inicio, metodo=request.method,
+                                       rota=rota.path if rota else "desconhecida", status=status_code)
+
 
 class UserCreate(BaseModel):
     username: str
     password: str
 
 
+class LoteProdutos(BaseModel):
+    # O Omie devolve codigo_produto numerico; o banco guarda o codigo como texto
+    codigos: List[Union[int, str]] = Field(..., min_length=1, max_length=PRODUTOS_LOTE_MAXIMO)
+    campos: Optional[List[str]] = None
+
+
 class Token(BaseModel):
     access_token: str
     token_type: str
 
 
 @app.post('/register')
-def register(user: UserCreate):
-    existing = get_user_by_username(user.username)
+async def register(user: UserCreate):
+    existing = await run_in_threadpool(get_user_by_username, user.username)
     if existing:
         raise HTTPException(status_code=400, detail="Username already registered")
-    hashed = get_password_hash(user.password)
-    create_user(user.username, hashed)
+    hashed = await get_password_hash_async(user.password)
+    await run_in_threadpool(create_user, user.username, hashed)
+    invalidate_user(user.username)
     return {"msg": "user created"}
 
 
 @app.post('/token', response_model=Token)
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = get_user_by_username(form_data.username)
-    if not user:
-        raise HTTPException(status_code=400, detail="Incorrect username or password")
-    if not verify_password(form_data.password, user['hashed_password']):
-        raise HTTPException(status_code=400, detail="Incorrect username or password")
+    try:
+        await asyncio.wait_for(_login_semaforo.acquire(), LOGIN_ESPERA_MAX)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=429, detail="Too many concurrent login attempts",
+                            headers={"Retry-After": "1"})
+    try:
+        user = await run_in_threadpool(get_user_by_username, form_data.username)
+        if not user:
+            raise HTTPException(status_code=400, detail="Incorrect username or password")
+        valid, new_hash = await verify_and_update_password_async(form_data.password, user['hashed_password'])
+        if not valid:
+            raise HTTPException(status_code=400, detail="Incorrect username or password")
+        if not user.get('is_active'):
+            raise HTTPException(status_code=400, detail="Inactive user")
+        if new_hash:
+            await run_in_threadpool(update_user_password, user['username'], new_hash)
+    finally:
+        _login_semaforo.release()
 
     access_token_expires = timedelta(minutes=int(os.getenv('ACCESS_TOKEN_EXPIRE_MINUTES', '60')))
     access_token = create_access_token(data={"sub": user['username']}, expires_delta=access_token_expires)
@@ -56,37 +135,242 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
 # Dependency
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     try:
-        payload = decode_access_token(token)
+        # Tokens e usuarios ja verificados saem do cache, sem jwt.decode nem SQLite
+        payload = decode_access_token_cached(token)
         username: str = payload.get('sub')
         if username is None:
             raise HTTPException(status_code=401, detail="Could not validate credentials")
     except Exception:
         raise HTTPException(status_code=401, detail="Could not validate credentials")
-    user = get_user_by_username(username)
+    # Cache no event loop; uma falta consulta o SQLite no threadpool
+    user = get_cached_user(username) or await run_in_threadpool(get_active_user, username)
     if not user:
         raise HTTPException(status_code=401, detail="User not found")
     return user
 
 
+def obter_conta(conta: str = Query(CONTA_PADRAO)) -> str:
+    # ?conta= escolhe a conta Omie (OMIE_CONTAS); cada conta tem o seu catalogo, busca e grupos
+    if conta not in contas_configuradas():
+        raise HTTPException(status_code=404, detail="Conta nao encontrada")
+    return conta
+
+
 @app.get('/')
 def root():
     return {"status": "ok"}
 
 
+@app.get('/metrics', include_in_schema=False)
+def metrics():
+    return PlainTextResponse(metricas.renderizar(), media_type="text/plain; version=0.0.4")
+
+
+def _aguardar_tarefa(tarefa):
+    tarefa.aguardar()
+    if tarefa.estado == FALHOU and tarefa.erro == agendador.MENSAGEM_EM_ANDAMENTO:
+        raise HTTPException(status_code=409, detail=tarefa.erro)
+    if tarefa.estado == FALHOU:
+        raise HTTPException(status_code=500, detail=tarefa.erro)
+    return tarefa.resultado
+
+
+def _tarefa_aceita(tarefa):
+    return JSONResponse(status_code=202, content={"tarefa": tarefa.id, "estado": tarefa.estado,
+                                                  "url": f"/jobs/{tarefa.id}"})
+
+
 @app.get('/sincronizar')
-def sincronizar(current_user=Depends(get_current_user)):
-    produtos = get_produtos()
-    salvar_produtos(produtos)
-    return {"mensagem": f"{len(produtos)} produtos importados e salvos no banco."}
+def sincronizar(completo: bool = False, em_segundo_plano: bool = False,
+                conta: str = Depends(obter_conta),
+                current_user=Depends(get_current_user)):
+    # Por padrao so busca o que mudou desde a ultima sincronizacao. Chamadas simultaneas do
+    # mesmo modo para a mesma conta reaproveitam a mesma tarefa em vez de consultar o Omie de
+    # novo; com a conta sincronizando em outro modo ou em outro worker/processo, responde 409.
+    if (agendador.sincronizacao_em_outro_processo(conta)
+            or tarefa_ativa(agendador.chave_sincronizacao(conta, completo)) is not None):
+        raise HTTPException(status_code=409, detail=agendador.MENSAGEM_EM_ANDAMENTO)
+    tarefa = submeter("sincronizar", agendador.sincronizar_exclusivo, incremental=not completo,
+                      conta=conta, chave=agendador.chave_sincronizacao(conta, not completo))
+    if em_segundo_plano:
+        return _tarefa_aceita(tarefa)
+    resultado = _aguardar_tarefa(tarefa)
+    return {
+        "mensagem": f"{resultado['produtos']} produtos importados e salvos no banco.",
+        "modo": resultado["modo"],
+        "gravados": resultado["gravados"],
+    }
 
 
 @app.get('/produtos')
-def listar(current_user=Depends(get_current_user)):
-    return {"dados": buscar_todos_produtos()}
+def listar(request: Request,
+           apos: int = 0,
+           limit: int = Query(PRODUTOS_LIMITE_PADRAO, ge=1, le=PRODUTOS_LIMITE_MAXIMO),
+           campos: Optional[str] = None,
+           formato: str = Query("json", pattern="^(json|ndjson)$"),
+           conta: str = Depends(obter_conta),
+           current_user=Depends(get_current_user)):
+    # Paginacao por cursor (id): ?apos=<proximo_cursor>&limit=N; ?campos=codigo,descricao
+    # Servido da copia em memoria do catalogo, sem consultar o banco por requisicao
+    lista_campos = [c.strip() for c in campos.split(",") if c.strip()] if campos else None
+    catalogo = obter_catalogo(conta)
+    etag = etag_catalogo(request, catalogo.versao)
+    if nao_modificado(request, etag):
+        return resposta_304(etag)
+    try:
+        if formato == "ndjson":
+            return com_etag(StreamingResponse(catalogo.linhas_ndjson(apos, lista_campos),
+                                              media_type="application/x-ndjson"), etag)
+        if not lista_campos:
+            return com_etag(Response(catalogo.pagina_json(apos, limit), media_type="application/json"), etag)
+        dados, proximo = catalogo.pagina(apos, limit, lista_campos)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return com_etag(RespostaJSONRapida({"dados": dados, "proximo_cursor": proximo}), etag)
+
+
+@app.post('/produtos/lote')
+def produtos_em_lote(lote: LoteProdutos, conta: str = Depends(obter_conta),
+                     current_user=Depends(get_current_user)):
+    # Detalhes de muitos codigos numa unica chamada, na ordem pedida; codigos repetidos voltam uma vez
+    codigos = [str(c) for c in lote.codigos]
+    try:
+        encontrados = buscar_produtos_por_codigos(codigos, lote.campos, conta)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    pedidos = list(dict.fromkeys(codigos))
+    return RespostaJSONRapida({
+        "dados": [encontrados[c] for c in pedidos if c in encontrados],
+        "nao_encontrados": [c for c in pedidos if c not in encontrados],
+    })
+
+
+@app.get('/produtos/busca')
+def buscar(request: Request,
+           q: str = Query(..., min_length=1),
+           limit: int = Query(20, ge=1, le=PRODUTOS_LIMITE_MAXIMO),
+           offset: int = Query(0, ge=0),
+           conta: str = Depends(obter_conta),
+           current_user=Depends(get_current_user)):
+    # Busca textual (FTS5) em descricao, modelo, volumetria e tamanho_molde, ordenada por relevancia
+    etag = etag_catalogo(request, versao_catalogo(conta))
+    if nao_modificado(request, etag):
+        return resposta_304(etag)
+    dados = buscar_produtos_texto(q, limit, offset, conta)
+    proximo = offset + limit if len(dados) == limit else None
+    return com_etag(RespostaJSONRapida({"dados": dados, "proximo_offset": proximo}), etag)
 
 
 @app.get('/agrupar')
-def agrupar(current_user=Depends(get_current_user)):
-    produtos = buscar_todos_produtos()
-    grupos = agrupar_produtos(produtos)
-    return {"total_grupos": len(grupos), "grupos": grupos}
\ No newline at end of file
+def agrupar(request: Request,
+            n_clusters: Optional[int] = Query(None, ge=2, le=AGRUPAMENTO_CLUSTERS_MAXIMO),
+            modo: str = Query(AGRUPAMENTO_MODO, pattern="^(completo|incremental)$"),
+            em_segundo_plano: bool = False,
+            conta: str = Depends(obter_conta),
+            current_user=Depends(get_current_user)):
+    # Reaproveita o resultado enquanto o catalogo nao mudar
+    etag = etag_catalogo(request, obter_catalogo(conta).versao)
+    if not em_segundo_plano and nao_modificado(request, etag):
+        return resposta_304(etag)
+    tarefa = submeter("agrupar", agrupar_catalogo, n_clusters, modo, conta=conta,
+                      chave=("agrupar", conta, n_clusters, modo))
+    if em_segundo_plano:
+        return _tarefa_aceita(tarefa)
+    resultado = _aguardar_tarefa(tarefa)
+    if resultado.get("desatualizado"):
+        # Resultado anterior (o calculo estourou o timeout): sem ETag, para o cliente nao
+        # revalidar com 304 e ficar preso a ele quando o calculo da versao atual terminar
+        return RespostaJSONRapida(resultado)
+    return com_etag(RespostaJSONRapida(resultado), etag)
+
+
+@app.get('/produtos/{codigo}/similares')
+def similares(request: Request,
+              codigo: str,
+              k: int = Query(SIMILARES_K_PADRAO, ge=1, le=SIMILARES_K_MAXIMO),
+              campos: Optional[str] = None,
+              conta: str = Depends(obter_conta),
+              current_user=Depends(get_current_user)):
+    # Vizinhos mais proximos por cosseno sobre o TF-IDF do catalogo (mesmo texto do agrupamento)
+    catalogo = obter_catalogo(conta)
+    etag = etag_catalogo(request, catalogo.versao)
+    if nao_modificado(request, etag):
+        return resposta_304(etag)
+    lista_campos = [c.strip() for c in campos.split(",") if c.strip()] if campos else None
+    vizinhos = buscar_similares(codigo, k, conta)
+    if vizinhos is None:
+        raise HTTPException(status_code=404, detail="Produto nao encontrado")
+    try:
+        produtos = catalogo.por_ids([i for i, _ in vizinhos], lista_campos)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    similaridade = dict(vizinhos)
+    dados = [{**p, "similaridade": similaridade[p["id"]]} for p in produtos]
+    return com_etag(RespostaJSONRapida({"produto": codigo, "dados": dados}), etag)
+
+
+def _agrupamento_persistido(conta: str) -> dict:
+    agrupamento = obter_agrupamento(conta)
+    if agrupamento is None:
+        raise HTTPException(status_code=404, detail="Nenhum agrupamento calculado; chame /agrupar")
+    return agrupamento
+
+
+def _etag_grupos(request: Request, agrupamento: dict) -> str:
+    # Muda quando um novo agrupamento e persistido, nao a cada versao do catalogo
+    return etag_catalogo(request, "g{versao_catalogo}.{n_clusters}.{modo}".format(**agrupamento))
+
+
+@app.get('/grupos')
+def grupos(request: Request, conta: str = Depends(obter_conta), current_user=Depends(get_current_user)):
+    # Le o ultimo agrupamento persistido, sem recalcular; "desatualizado" indica que o catalogo mudou depois
+    agrupamento = _agrupamento_persistido(conta)
+    etag = _etag_grupos(request, agrupamento)
+    if nao_modificado(request, etag):
+        return resposta_304(etag)
+    return com_etag(RespostaJSONRapida({
+        **agrupamento,
+        "desatualizado": agrupamento["versao_catalogo"] != versao_catalogo(conta),
+        "dados": listar_grupos(conta),
+    }), etag)
+
+
+@app.get('/grupos/{grupo_id}/produtos')
+def produtos_do_grupo(request: Request,
+                      grupo_id: int,
+                      apos: int = 0,
+                      limit: int = Query(PRODUTOS_LIMITE_PADRAO, ge=1, le=PRODUTOS_LIMITE_MAXIMO),
+                      campos: Optional[str] = None,
+                      conta: str = Depends(obter_conta),
+                      current_user=Depends(get_current_user)):
+    agrupamento = _agrupamento_persistido(conta)
+    etag = _etag_grupos(request, agrupamento)
+    if nao_modificado(request, etag):
+        return resposta_304(etag)
+    grupo = buscar_grupo(grupo_id, conta)
+    if grupo is None:
+        raise HTTPException(status_code=404, detail="Grupo nao encontrado")
+    lista_campos = [c.strip() for c in campos.split(",") if c.strip()] if campos else None
+    try:
+        dados = buscar_produtos_grupo(grupo_id, apos, limit, lista_campos, conta)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    proximo = dados[-1]["id"] if len(dados) == limit else None
+    return com_etag(RespostaJSONRapida({"grupo": grupo, "dados": dados, "proximo_cursor": proximo}), etag)
+
+
+@app.get('/produtos/{codigo}/grupo')
+def grupo_do_produto(codigo: str, conta: str = Depends(obter_conta),
+                     current_user=Depends(get_current_user)):
+    grupo = buscar_grupo_produto(codigo, conta)
+    if grupo is None:
+        raise HTTPException(status_code=404, detail="Produto sem grupo; chame /agrupar")
+    return RespostaJSONRapida(grupo)
+
+
+@app.get('/jobs/{id_tarefa}')
+def consultar_tarefa(id_tarefa: str, current_user=Depends(get_current_user)):
+    tarefa = obter_tarefa(id_tarefa)
+    if tarefa is None:
+        raise HTTPException(status_code=404, detail="Tarefa nao encontrada")
+    return tarefa.como_dict()
\ No newline at end of file
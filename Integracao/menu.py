@@ -1,34 +1,80 @@
 from flask import Flask
 from flask import render_template, redirect, request
 from flask import flash
+import hmac
 import json
+import os
+import threading
+
+from autenticacao import PWD_CONTEXT, get_active_user
 
 app = Flask(__name__)
 
 app.config['SECRET_KEY'] = 'COPACK'
 
+# "arquivo" le usuarios.json; "banco" usa a mesma tabela users do backend FastAPI
+MENU_USUARIOS_FONTE = os.getenv("MENU_USUARIOS_FONTE", "arquivo")
+MENU_USUARIOS_ARQUIVO = os.getenv("MENU_USUARIOS_ARQUIVO", "usuarios.json")
+
+
+class UsuariosArquivo:
+    """Usuarios do JSON indexados por nome; o arquivo so e relido quando o mtime muda."""
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._mtime = None
+        self._usuarios = {}
+        self._lock = threading.Lock()
+
+    def _atualizar(self):
+        mtime = os.stat(self.caminho).st_mtime_ns
+        if mtime == self._mtime:
+            return
+        with self._lock:
+            if mtime != self._mtime:
+                with open(self.caminho) as arquivo:
+                    self._usuarios = {u['nome']: u for u in json.load(arquivo)}
+                self._mtime = mtime
+
+    def buscar(self, nome):
+        self._atualizar()
+        return self._usuarios.get(nome)
+
+
+usuarios_arquivo = UsuariosArquivo(MENU_USUARIOS_ARQUIVO)
+
+
+def verificar_usuario(nome, senha):
+    if not nome or not senha:
+        return False
+    if MENU_USUARIOS_FONTE == "banco":
+        user = get_active_user(nome)
+        return bool(user) and PWD_CONTEXT.verify(senha, user['hashed_password'])
+
+    user = usuarios_arquivo.buscar(nome)
+    if not user:
+        return False
+    if 'senha_hash' in user:
+        return PWD_CONTEXT.verify(senha, user['senha_hash'])
+    # Arquivos antigos ainda com senha em texto puro; em bytes, porque compare_digest
+    # recusa str com caracteres fora do ASCII
+    return hmac.compare_digest(user.get('senha', '').encode('utf-8'), senha.encode('utf-8'))
+
+
 @app.route("/")
 def nome ():
     return render_template("login.html")
-@app.route(".login", methods=['POST'])
+@app.route("/login", methods=['POST'])
 def login():
-        
+
     nome = request.form.get('nome')
     senha = request.form.get('senha')
 
-    with open('usuarios.json') as tempuser:
-        users = json.load(tempuser)
+    if verificar_usuario(nome, senha):
+        return render_template('usuarios.html')
 
-        cont = 0
-        for user in users:
-            cont += 1
+    flash('Usuario Invalido')
+    return redirect('/')
 
-            if user['nome'] == nome and user['senha'] == senha:
-                return render_template('usuarios.html')
-            
-            if cont >= len(users):
-                flash('Usuario Invalido')
-                return redirect('/')
-            
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True)
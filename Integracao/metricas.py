@@ -0,0 +1,139 @@
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+# Metricas em memoria do processo, expostas em /metrics no formato texto do Prometheus
+
+BUCKETS_PADRAO = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_registro = []
+
+
+def _rotulos(nomes, valores) -> str:
+    if not nomes:
+        return ""
+    pares = ",".join(
+        '{}="{}"'.format(n, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for n, v in zip(nomes, valores)
+    )
+    return "{" + pares + "}"
+
+
+def _numero(valor) -> str:
+    return repr(float(valor)) if valor != int(valor) else str(int(valor))
+
+
+class _Metrica:
+    tipo = ""
+
+    def __init__(self, nome: str, ajuda: str, rotulos=()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self._valores = {}
+        self._lock = threading.Lock()
+        _registro.append(self)
+
+    def _chave(self, rotulos: dict) -> tuple:
+        return tuple(rotulos.get(n, "") for n in self.rotulos)
+
+    def _amostras(self):
+        with self._lock:
+            return [(self.nome, _rotulos(self.rotulos, chave), valor) for chave, valor in self._valores.items()]
+
+    def renderizar(self) -> str:
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} {self.tipo}"]
+        linhas += [f"{nome}{rotulos} {_numero(valor)}" for nome, rotulos, valor in self._amostras()]
+        return "\n".join(linhas)
+
+
+class Contador(_Metrica):
+    tipo = "counter"
+
+    def inc(self, valor: float = 1, **rotulos):
+        chave = self._chave(rotulos)
+        with self._lock:
+            self._valores[chave] = self._valores.get(chave, 0) + valor
+
+
+class Medidor(_Metrica):
+    tipo = "gauge"
+
+    def inc(self, valor: float = 1, **rotulos):
+        chave = self._chave(rotulos)
+        with self._lock:
+            self._valores[chave] = self._valores.get(chave, 0) + valor
+
+    def dec(self, valor: float = 1, **rotulos):
+        self.inc(-valor, **rotulos)
+
+    def set(self, valor: float, **rotulos):
+        with self._lock:
+            self._valores[self._chave(rotulos)] = valor
+
+
+class Histograma(_Metrica):
+    tipo = "histogram"
+
+    def __init__(self, nome: str, ajuda: str, rotulos=(), buckets=BUCKETS_PADRAO):
+        super().__init__(nome, ajuda, rotulos)
+        self.buckets = tuple(sorted(buckets))
+
+    def observar(self, valor: float, **rotulos):
+        chave = self._chave(rotulos)
+        with self._lock:
+            contagens, soma, total = self._valores.get(chave, ([0] * len(self.buckets), 0.0, 0))
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    contagens[i] += 1
+            self._valores[chave] = (contagens, soma + valor, total + 1)
+
+    def _amostras(self):
+        nomes = self.rotulos + ("le",)
+        amostras = []
+        with self._lock:
+            for chave, (contagens, soma, total) in self._valores.items():
+                for limite, contagem in zip(self.buckets, contagens):
+                    amostras.append((f"{self.nome}_bucket", _rotulos(nomes, chave + (_numero(limite),)), contagem))
+                amostras.append((f"{self.nome}_bucket", _rotulos(nomes, chave + ("+Inf",)), total))
+                amostras.append((f"{self.nome}_sum", _rotulos(self.rotulos, chave), soma))
+                amostras.append((f"{self.nome}_count", _rotulos(self.rotulos, chave), total))
+        return amostras
+
+
+@contextmanager
+def cronometrar(histograma: Histograma, **rotulos):
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        histograma.observar(time.perf_counter() - inicio, **rotulos)
+
+
+def cronometrado(operacao: str):
+    """Decorator que registra a duracao da funcao em operacao_duracao_segundos."""
+    def decorador(funcao):
+        @functools.wraps(funcao)
+        def envolvida(*args, **kwargs):
+            with cronometrar(OPERACAO_DURACAO, operacao=operacao):
+                return funcao(*args, **kwargs)
+        return envolvida
+    return decorador
+
+
+def renderizar() -> str:
+    return "\n".join(m.renderizar() for m in _registro) + "\n"
+
+
+HTTP_DURACAO = Histograma("http_requisicao_duracao_segundos", "Latencia das requisicoes HTTP por rota",
+                          ("metodo", "rota", "status"))
+HTTP_EM_ANDAMENTO = Medidor("http_requisicoes_em_andamento", "Requisicoes HTTP em processamento", ("metodo",))
+OMIE_DURACAO = Histograma("omie_chamada_duracao_segundos", "Duracao das chamadas a API do Omie",
+                          ("call", "resultado"))
+OPERACAO_DURACAO = Histograma("operacao_duracao_segundos",
+                              "Duracao de operacoes internas (Omie, SQLite, agrupamento)", ("operacao",))
+PRODUTOS_RECEBIDOS = Contador("produtos_recebidos_total", "Produtos recebidos do Omie nas sincronizacoes",
+                              ("conta",))
+PRODUTOS_GRAVADOS = Contador("produtos_gravados_total", "Produtos inseridos ou alterados no banco", ("conta",))
+CACHE_CONSULTAS = Contador("cache_consultas_total", "Consultas aos caches em memoria", ("cache", "resultado"))
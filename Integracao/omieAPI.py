@@ -1,19 +1,314 @@
+import asyncio
 import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
 import requests
+from requests.adapters import HTTPAdapter
+
+import contas
+from contas import CONTA_PADRAO
+from metricas import OMIE_DURACAO, cronometrado
 
-OMIE_URL = "https://app.omie.com.br/api/v1/geral/produtos/"
+OMIE_BASE_URL = os.getenv("OMIE_BASE_URL", "https://app.omie.com.br/api/v1/")
+OMIE_URL = os.getenv("OMIE_URL", OMIE_BASE_URL + "geral/produtos/")
 OMIE_APP_KEY = os.getenv("OMIE_APP_KEY")
 OMIE_APP_SECRET = os.getenv("OMIE_APP_SECRET")
 
+# Limites da sincronizacao paginada (Omie aceita poucas requisicoes simultaneas por metodo)
+OMIE_REGISTROS_POR_PAGINA = int(os.getenv("OMIE_REGISTROS_POR_PAGINA", "100"))
+OMIE_MAX_WORKERS = int(os.getenv("OMIE_MAX_WORKERS", "4"))
+OMIE_MAX_REQ_POR_SEGUNDO = float(os.getenv("OMIE_MAX_REQ_POR_SEGUNDO", "3"))
+OMIE_RAJADA = int(os.getenv("OMIE_RAJADA", "3"))
+
+# Timeout (segundos) e novas tentativas com backoff exponencial
+OMIE_TIMEOUT = float(os.getenv("OMIE_TIMEOUT", "30"))
+OMIE_MAX_TENTATIVAS = int(os.getenv("OMIE_MAX_TENTATIVAS", "5"))
+OMIE_BACKOFF_BASE = float(os.getenv("OMIE_BACKOFF_BASE", "1"))
+OMIE_BACKOFF_MAX = float(os.getenv("OMIE_BACKOFF_MAX", "60"))
+
+STATUS_TEMPORARIOS = {429, 502, 503, 504}
+# Falhas do Omie (faultstring) que passam se a chamada for repetida mais tarde
+FALHAS_TEMPORARIAS = ("consumo redundante", "redundant", "tente novamente", "bloqueada", "timeout")
+
+
+class ErroOmie(Exception):
+    def __init__(self, mensagem: str, status: Optional[int] = None, temporario: bool = False):
+        super().__init__(mensagem)
+        self.status = status
+        self.temporario = temporario
+
+    @property
+    def sem_registros(self) -> bool:
+        # Omie responde com erro quando um filtro nao encontra nenhum registro
+        return "Não existem registros" in str(self)
+
+
+class BaldeTokens:
+    """Token bucket: ate `capacidade` chamadas em rajada, repostas a `por_segundo` por segundo."""
+
+    def __init__(self, por_segundo: float, capacidade: int = 1):
+        self.por_segundo = por_segundo
+        self.capacidade = max(1, capacidade)
+        self._tokens = float(self.capacidade)
+        self._atualizado = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reservar(self) -> float:
+        """Consome um token e devolve quantos segundos esperar ate ele estar disponivel."""
+        if self.por_segundo <= 0:
+            return 0.0
+        with self._lock:
+            agora = time.monotonic()
+            self._tokens = min(self.capacidade, self._tokens + (agora - self._atualizado) * self.por_segundo)
+            self._atualizado = agora
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.por_segundo
+
+    def aguardar(self):
+        espera = self.reservar()
+        if espera > 0:
+            time.sleep(espera)
+
+    async def aguardar_async(self):
+        espera = self.reservar()
+        if espera > 0:
+            await asyncio.sleep(espera)
+
+
+def _espera_backoff(tentativa: int) -> float:
+    teto = min(OMIE_BACKOFF_MAX, OMIE_BACKOFF_BASE * (2 ** tentativa))
+    return random.uniform(teto / 2, teto)
+
+
+def _verificar_resposta(status: int, corpo) -> dict:
+    falha = corpo.get("faultstring") if isinstance(corpo, dict) else None
+    if status < 400 and not falha:
+        return corpo
+    mensagem = falha or f"HTTP {status}"
+    temporario = status in STATUS_TEMPORARIOS or (
+        falha is not None and any(t in falha.lower() for t in FALHAS_TEMPORARIAS)
+    ) or (falha is None and status >= 500)
+    raise ErroOmie(mensagem, status=status, temporario=temporario)
+
+
+def _payload(call: str, param: dict, app_key, app_secret) -> dict:
+    return {"call": call, "app_key": app_key, "app_secret": app_secret, "param": [param]}
+
+
+def _pagina_vazia(pagina: int) -> dict:
+    return {"pagina": pagina, "total_de_paginas": 0, "produto_servico_cadastro": []}
+
+
+def _param_listagem(pagina, registros_por_pagina, filtros) -> dict:
+    param = {"pagina": pagina, "registros_por_pagina": registros_por_pagina}
+    if filtros:
+        param.update(filtros)
+    return param
+
+
+class OmieClient:
+    """Cliente sincrono: sessao HTTP persistente, timeout, retentativas e limite de taxa."""
+
+    def __init__(self, app_key: Optional[str] = None, app_secret: Optional[str] = None,
+                 base_url: str = OMIE_BASE_URL, timeout: float = OMIE_TIMEOUT,
+                 max_tentativas: int = OMIE_MAX_TENTATIVAS, limitador: Optional[BaldeTokens] = None):
+        self.app_key = app_key or OMIE_APP_KEY
+        self.app_secret = app_secret or OMIE_APP_SECRET
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_tentativas = max(1, max_tentativas)
+        self.limitador = limitador or BaldeTokens(OMIE_MAX_REQ_POR_SEGUNDO, OMIE_RAJADA)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(OMIE_MAX_WORKERS, 1))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _url(self, endpoint: str) -> str:
+        return endpoint if endpoint.startswith("http") else self.base_url + endpoint
+
+    def chamar(self, endpoint: str, call: str, param: dict) -> dict:
+        payload = _payload(call, param, self.app_key, self.app_secret)
+        for tentativa in range(self.max_tentativas):
+            self.limitador.aguardar()
+            inicio = time.perf_counter()
+            resultado = "erro"
+            try:
+                r = self.session.post(self._url(endpoint), json=payload, timeout=self.timeout)
+                try:
+                    corpo = r.json()
+                except ValueError:
+                    corpo = None
+                resposta = _verificar_resposta(r.status_code, corpo)
+                resultado = "ok"
+                return resposta
+            except (requests.ConnectionError, requests.Timeout, ErroOmie) as e:
+                if isinstance(e, ErroOmie) and not e.temporario:
+                    raise
+                if tentativa == self.max_tentativas - 1:
+                    raise
+            finally:
+                OMIE_DURACAO.observar(time.perf_counter() - inicio, call=call, resultado=resultado)
+            time.sleep(_espera_backoff(tentativa))
+
+    # Uma pagina da sincronizacao, com as novas tentativas e o backoff (omie_chamada_duracao_segundos
+    # mede cada tentativa)
+    @cronometrado("omie_listar_produtos")
+    def listar_produtos(self, pagina: int = 1, registros_por_pagina: int = 100,
+                        filtros: Optional[dict] = None) -> dict:
+        try:
+            return self.chamar(OMIE_URL, "ListarProdutos",
+                               _param_listagem(pagina, registros_por_pagina, filtros))
+        except ErroOmie as e:
+            if e.sem_registros:
+                return _pagina_vazia(pagina)
+            raise
+
+    def consultar_produto(self, codigo_produto: Optional[int] = None, codigo: Optional[str] = None) -> dict:
+        param = {"codigo_produto": codigo_produto} if codigo_produto else {"codigo": codigo}
+        return self.chamar(OMIE_URL, "ConsultarProduto", param)
+
+    def pesquisar_familias(self, pagina: int = 1, registros_por_pagina: int = 100) -> dict:
+        return self.chamar("geral/familias/", "PesquisarFamilias",
+                           {"pagina": pagina, "registros_por_pagina": registros_por_pagina})
+
+    def iterar_paginas(self, registros_por_pagina: int = OMIE_REGISTROS_POR_PAGINA,
+                       max_workers: int = OMIE_MAX_WORKERS,
+                       filtros: Optional[dict] = None,
+                       a_partir_de: int = 1):
+        """Gera (pagina, total_paginas, registros) em ordem de pagina.
+
+        A pagina inicial informa o total; as seguintes sao buscadas em paralelo, no maximo
+        `max_workers` adiante da ultima entregue, entao a memoria nao cresce com o catalogo.
+        """
+        primeira = self.listar_produtos(a_partir_de, registros_por_pagina, filtros)
+        total_paginas = int(primeira.get("total_de_paginas", 1) or 1)
+        yield a_partir_de, total_paginas, primeira.get("produto_servico_cadastro", [])
+
+        janela = max(1, max_workers)
+        proxima = a_partir_de + 1
+        pendentes = deque()
+        with ThreadPoolExecutor(max_workers=janela) as executor:
+            try:
+                while pendentes or proxima <= total_paginas:
+                    while proxima <= total_paginas and len(pendentes) < janela:
+                        pendentes.append((proxima, executor.submit(
+                            self.listar_produtos, proxima, registros_por_pagina, filtros)))
+                        proxima += 1
+                    pagina, futuro = pendentes.popleft()
+                    yield pagina, total_paginas, futuro.result().get("produto_servico_cadastro", [])
+            finally:
+                for _, futuro in pendentes:
+                    futuro.cancel()
+
+    def fechar(self):
+        self.session.close()
+
+
+class OmieClientAsync:
+    """Variante asyncio do OmieClient (requer httpx)."""
+
+    def __init__(self, app_key: Optional[str] = None, app_secret: Optional[str] = None,
+                 base_url: str = OMIE_BASE_URL, timeout: float = OMIE_TIMEOUT,
+                 max_tentativas: int = OMIE_MAX_TENTATIVAS, limitador: Optional[BaldeTokens] = None):
+        try:
+            import httpx
+        except ImportError as e:
+            raise RuntimeError("OmieClientAsync requer o pacote httpx") from e
+        self._httpx = httpx
+        self.app_key = app_key or OMIE_APP_KEY
+        self.app_secret = app_secret or OMIE_APP_SECRET
+        self.base_url = base_url
+        self.max_tentativas = max(1, max_tentativas)
+        self.limitador = limitador or BaldeTokens(OMIE_MAX_REQ_POR_SEGUNDO, OMIE_RAJADA)
+        self.client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max(OMIE_MAX_WORKERS, 1),
+                                max_keepalive_connections=max(OMIE_MAX_WORKERS, 1)),
+        )
+
+    def _url(self, endpoint: str) -> str:
+        return endpoint if endpoint.startswith("http") else self.base_url + endpoint
+
+    async def chamar(self, endpoint: str, call: str, param: dict) -> dict:
+        payload = _payload(call, param, self.app_key, self.app_secret)
+        for tentativa in range(self.max_tentativas):
+            await self.limitador.aguardar_async()
+            try:
+                r = await self.client.post(self._url(endpoint), json=payload)
+                try:
+                    corpo = r.json()
+                except ValueError:
+                    corpo = None
+                return _verificar_resposta(r.status_code, corpo)
+            except (self._httpx.TransportError, ErroOmie) as e:
+                if isinstance(e, ErroOmie) and not e.temporario:
+                    raise
+                if tentativa == self.max_tentativas - 1:
+                    raise
+            await asyncio.sleep(_espera_backoff(tentativa))
+
+    async def listar_produtos(self, pagina: int = 1, registros_por_pagina: int = 100,
+                              filtros: Optional[dict] = None) -> dict:
+        try:
+            return await self.chamar(OMIE_URL, "ListarProdutos",
+                                     _param_listagem(pagina, registros_por_pagina, filtros))
+        except ErroOmie as e:
+            if e.sem_registros:
+                return _pagina_vazia(pagina)
+            raise
+
+    async def get_todos_produtos(self, registros_por_pagina: int = OMIE_REGISTROS_POR_PAGINA,
+                                 max_workers: int = OMIE_MAX_WORKERS,
+                                 filtros: Optional[dict] = None):
+        primeira = await self.listar_produtos(1, registros_por_pagina, filtros)
+        produtos = list(primeira.get("produto_servico_cadastro", []))
+        total_paginas = int(primeira.get("total_de_paginas", 1) or 1)
+        semaforo = asyncio.Semaphore(max(1, max_workers))
+
+        async def buscar(pagina):
+            async with semaforo:
+                data = await self.listar_produtos(pagina, registros_por_pagina, filtros)
+                return data.get("produto_servico_cadastro", [])
+
+        for registros in await asyncio.gather(*(buscar(p) for p in range(2, total_paginas + 1))):
+            produtos.extend(registros)
+        return produtos
+
+    async def fechar(self):
+        await self.client.aclose()
+
+
+# Um cliente por conta: sessao e orcamento de requisicoes (BaldeTokens) separados
+_clientes: Dict[str, OmieClient] = {}
+_lock_cliente = threading.Lock()
+
+
+def cliente_conta(conta: str = CONTA_PADRAO) -> OmieClient:
+    with _lock_cliente:
+        cliente = _clientes.get(conta)
+        if cliente is None:
+            if conta not in contas.CONTAS:
+                raise KeyError(f"Conta Omie nao configurada: {conta}")
+            config = contas.CONTAS[conta]
+            limitador = BaldeTokens(float(config.get("max_req_por_segundo", OMIE_MAX_REQ_POR_SEGUNDO)),
+                                    int(config.get("rajada", OMIE_RAJADA)))
+            cliente = _clientes[conta] = OmieClient(config.get("app_key"), config.get("app_secret"),
+                                                    limitador=limitador)
+        return cliente
+
+
+def cliente_padrao() -> OmieClient:
+    return cliente_conta(CONTA_PADRAO)
+
 
-def get_produtos(pagina: int = 1, registros_por_pagina: int = 100):
-    payload = {
-        "call": "ListarProdutos",
-        "app_key": OMIE_APP_KEY,
-        "app_secret": OMIE_APP_SECRET,
-        "param": [{"pagina": pagina, "registros_por_pagina": registros_por_pagina}]
-    }
-    r = requests.post(OMIE_URL, json=payload)
-    r.raise_for_status()
-    data = r.json()
-    return data.get("produto_servico_cadastro", [])
\ No newline at end of file
+def iterar_paginas(registros_por_pagina: int = OMIE_REGISTROS_POR_PAGINA,
+                   max_workers: int = OMIE_MAX_WORKERS,
+                   filtros: Optional[dict] = None,
+                   a_partir_de: int = 1,
+                   conta: str = CONTA_PADRAO):
+    return cliente_conta(conta).iterar_paginas(registros_por_pagina, max_workers, filtros, a_partir_de)
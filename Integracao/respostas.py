@@ -0,0 +1,68 @@
+import hashlib
+import json
+import os
+from typing import Any
+
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+from starlette.middleware.gzip import GZipMiddleware
+
+try:
+    import orjson
+except ImportError:  # orjson e opcional; sem ele cai no json da biblioteca padrao
+    orjson = None
+
+# Respostas menores que isso nao compensam compressao
+COMPRESSAO_TAMANHO_MINIMO = int(os.getenv("COMPRESSAO_TAMANHO_MINIMO", "1024"))
+COMPRESSAO_BROTLI = os.getenv("COMPRESSAO_BROTLI", "1") == "1"
+
+
+class RespostaJSONRapida(JSONResponse):
+    """JSON serializado direto com orjson, sem passar pelo jsonable_encoder do FastAPI."""
+
+    def render(self, content: Any) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def serializar(conteudo: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(conteudo)
+    return json.dumps(conteudo, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def configurar_compressao(app):
+    # Brotli quando o pacote brotli-asgi esta instalado (com fallback para gzip), senao gzip
+    if COMPRESSAO_BROTLI:
+        try:
+            from brotli_asgi import BrotliMiddleware
+        except ImportError:
+            pass
+        else:
+            app.add_middleware(BrotliMiddleware, minimum_size=COMPRESSAO_TAMANHO_MINIMO, gzip_fallback=True)
+            return
+    app.add_middleware(GZipMiddleware, minimum_size=COMPRESSAO_TAMANHO_MINIMO)
+
+
+def etag_catalogo(request: Request, versao: int) -> str:
+    # Fraca: o corpo comprimido muda os bytes, mas o conteudo e o mesmo para a mesma versao
+    consulta = hashlib.sha1(f"{request.url.path}?{request.url.query}".encode("utf-8")).hexdigest()[:16]
+    return f'W/"{versao}-{consulta}"'
+
+
+def nao_modificado(request: Request, etag: str) -> bool:
+    enviados = request.headers.get("if-none-match")
+    if not enviados:
+        return False
+    return enviados.strip() == "*" or etag in [e.strip() for e in enviados.split(",")]
+
+
+def resposta_304(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+
+def com_etag(resposta: Response, etag: str) -> Response:
+    resposta.headers["ETag"] = etag
+    resposta.headers["Cache-Control"] = "no-cache"
+    return resposta
@@ -0,0 +1,125 @@
+import os
+import threading
+from typing import Dict, List, Optional
+
+# Mesmo texto e vocabulario do agrupamento (enumeracaoIA); scikit-learn/numpy/scipy sao
+# importados dentro das funcoes, como la.
+
+from catalogo import obter_catalogo
+from database import CONTA_PADRAO
+from enumeracaoIA import STOP_WORDS_PT, AGRUPAMENTO_FRACAO_RETREINO, _texto
+from metricas import cronometrado
+
+SIMILARES_K_PADRAO = int(os.getenv("SIMILARES_K_PADRAO", "10"))
+SIMILARES_K_MAXIMO = int(os.getenv("SIMILARES_K_MAXIMO", "100"))
+
+
+class IndiceSimilares:
+    """Matriz TF-IDF esparsa (linhas normalizadas L2) de todo o catalogo.
+
+    Com as linhas normalizadas, o cosseno entre um produto e todos os outros e um unico
+    produto matriz-vetor esparso; o top-k sai de um argpartition, sem ordenar o catalogo.
+    """
+
+    def __init__(self, vectorizer, matriz, ids: List[int], codigos: List[str], hashes: List[str], versao: int):
+        self.vectorizer = vectorizer
+        self.matriz = matriz
+        self.ids = ids
+        self.codigos = codigos
+        self.hashes = hashes
+        self.versao = versao
+        self.posicao = {c: i for i, c in enumerate(codigos)}
+
+    @classmethod
+    def construir(cls, produtos: List[Dict], versao: int) -> "IndiceSimilares":
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        vectorizer = TfidfVectorizer(stop_words=STOP_WORDS_PT)
+        matriz = vectorizer.fit_transform([_texto(p) for p in produtos]).tocsr()
+        return cls(vectorizer, matriz, [p["id"] for p in produtos], [p["codigo"] for p in produtos],
+                   [p.get("hash") for p in produtos], versao)
+
+    def atualizar(self, produtos: List[Dict], versao: int) -> "IndiceSimilares":
+        """Novo indice com os produtos novos/alterados; os demais mantem as linhas ja calculadas."""
+        import scipy.sparse as sp
+
+        conhecidos = {c: h for c, h in zip(self.codigos, self.hashes)}
+        alterados = [p for p in produtos if conhecidos.get(p["codigo"], "") != p.get("hash")]
+        if not alterados:
+            return IndiceSimilares(self.vectorizer, self.matriz, self.ids, self.codigos, self.hashes, versao)
+        if len(alterados) > AGRUPAMENTO_FRACAO_RETREINO * len(produtos):
+            # Muita coisa mudou: o vocabulario/idf antigo ja nao representa o catalogo
+            return IndiceSimilares.construir(produtos, versao)
+
+        codigos_alterados = {p["codigo"] for p in alterados}
+        manter = [i for i, c in enumerate(self.codigos) if c not in codigos_alterados]
+        matriz = sp.vstack([self.matriz[manter],
+                            self.vectorizer.transform([_texto(p) for p in alterados])]).tocsr()
+        return IndiceSimilares(
+            self.vectorizer, matriz,
+            [self.ids[i] for i in manter] + [p["id"] for p in alterados],
+            [self.codigos[i] for i in manter] + [p["codigo"] for p in alterados],
+            [self.hashes[i] for i in manter] + [p.get("hash") for p in alterados],
+            versao,
+        )
+
+    def similares(self, codigo: str, k: int) -> Optional[List[tuple]]:
+        """Lista de (id, similaridade) dos k produtos mais proximos, sem o proprio produto."""
+        import numpy as np
+
+        linha = self.posicao.get(codigo)
+        if linha is None:
+            return None
+        pontuacoes = (self.matriz @ self.matriz[linha].T).toarray().ravel()
+        pontuacoes[linha] = -1.0
+        k = min(k, len(pontuacoes) - 1)
+        if k <= 0:
+            return []
+        melhores = np.argpartition(-pontuacoes, k - 1)[:k]
+        melhores = melhores[np.argsort(-pontuacoes[melhores], kind="stable")]
+        return [(self.ids[i], round(float(pontuacoes[i]), 4)) for i in melhores]
+
+
+# Um indice por conta Omie
+_indices: Dict[str, IndiceSimilares] = {}
+_lock_indice = threading.Lock()
+
+
+@cronometrado("indice_similares")
+def _recalcular(atual: Optional[IndiceSimilares], produtos: List[Dict], versao: int) -> IndiceSimilares:
+    if atual is None:
+        return IndiceSimilares.construir(produtos, versao)
+    return atual.atualizar(produtos, versao)
+
+
+def obter_indice(conta: str = CONTA_PADRAO, verificar: bool = False) -> Optional[IndiceSimilares]:
+    # A versao vem do catalogo em memoria; so recalcula quando ele mudou
+    catalogo = obter_catalogo(conta, verificar)
+    indice = _indices.get(conta)
+    if indice is not None and indice.versao == catalogo.versao:
+        return indice
+    with _lock_indice:
+        indice = _indices.get(conta)
+        if indice is None or indice.versao != catalogo.versao:
+            if not len(catalogo):
+                return None
+            indice = _indices[conta] = _recalcular(indice, catalogo.registros(), catalogo.versao)
+        return indice
+
+
+def atualizar_indice(conta: str = CONTA_PADRAO):
+    """Chamado apos uma sincronizacao: so atualiza se o indice ja foi carregado por alguma consulta."""
+    if conta in _indices:
+        obter_indice(conta, verificar=True)
+
+
+def buscar_similares(codigo: str, k: int = SIMILARES_K_PADRAO,
+                     conta: str = CONTA_PADRAO) -> Optional[List[tuple]]:
+    indice = obter_indice(conta)
+    if indice is None:
+        return None
+    return indice.similares(codigo, k)
+
+
+def limpar_indice():
+    with _lock_indice:
+        _indices.clear()
@@ -0,0 +1,165 @@
+import json
+import os
+import queue
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+from zoneinfo import ZoneInfo
+
+from omieAPI import iterar_paginas, OMIE_REGISTROS_POR_PAGINA
+from database import salvar_produtos, obter_estado, salvar_estado, remover_estado, chave_conta, CONTA_PADRAO
+from enumeracaoIA import invalidar_agrupamento
+from similares import atualizar_indice
+from metricas import PRODUTOS_RECEBIDOS, PRODUTOS_GRAVADOS, cronometrado
+
+# Marca d'agua da ultima sincronizacao concluida, gravada em ISO 8601 com o offset
+MARCA_SINCRONIZACAO = "ultima_sincronizacao"
+# Os filtros de data/hora do Omie sao interpretados no horario de Brasilia, qualquer que seja
+# o fuso deste servidor
+FUSO_OMIE = ZoneInfo(os.getenv("OMIE_FUSO_HORARIO", "America/Sao_Paulo"))
+# Margem para cobrir diferencas de relogio entre este servidor e o Omie
+SYNC_MARGEM_MINUTOS = int(os.getenv("SYNC_MARGEM_MINUTOS", "5"))
+
+# Ultima pagina gravada de uma sincronizacao em andamento; uma nova execucao com os mesmos
+# filtros continua dali em vez de recomecar
+CHECKPOINT_SINCRONIZACAO = "sincronizacao_checkpoint"
+# Paginas recebidas do Omie aguardando gravacao (limita a memoria da sincronizacao)
+SYNC_FILA_PAGINAS = int(os.getenv("SYNC_FILA_PAGINAS", "4"))
+
+_FIM = object()
+
+
+class SincronizacaoInterrompida(RuntimeError):
+    pass
+
+
+def agora_omie() -> datetime:
+    return datetime.now(FUSO_OMIE).replace(microsecond=0)
+
+
+def _ler_marca(valor: str) -> datetime:
+    marca = datetime.fromisoformat(valor)
+    # Marcas antigas, sem offset, foram gravadas no horario do Omie
+    return marca if marca.tzinfo else marca.replace(tzinfo=FUSO_OMIE)
+
+
+def filtros_alterados_desde(marca: datetime) -> dict:
+    desde = marca.astimezone(FUSO_OMIE) - timedelta(minutes=SYNC_MARGEM_MINUTOS)
+    return {
+        "filtrar_por_data_de": desde.strftime("%d/%m/%Y"),
+        "filtrar_por_hora_de": desde.strftime("%H:%M:%S"),
+    }
+
+
+def ultima_sincronizacao(conta: str = CONTA_PADRAO) -> Optional[datetime]:
+    valor = obter_estado(chave_conta(MARCA_SINCRONIZACAO, conta))
+    return _ler_marca(valor) if valor else None
+
+
+def checkpoint_pendente(filtros: Optional[dict], conta: str = CONTA_PADRAO) -> Optional[dict]:
+    valor = obter_estado(chave_conta(CHECKPOINT_SINCRONIZACAO, conta))
+    if not valor:
+        return None
+    checkpoint = json.loads(valor)
+    # Paginas so se correspondem com os mesmos filtros e o mesmo tamanho de pagina
+    if checkpoint["filtros"] != filtros or checkpoint["registros_por_pagina"] != OMIE_REGISTROS_POR_PAGINA:
+        return None
+    return checkpoint
+
+
+def _entregar(fila: queue.Queue, item, parar: threading.Event) -> bool:
+    while not parar.is_set():
+        try:
+            fila.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _produzir(fila: queue.Queue, parar: threading.Event, filtros: Optional[dict], a_partir_de: int,
+              conta: str):
+    paginas = iterar_paginas(OMIE_REGISTROS_POR_PAGINA, filtros=filtros, a_partir_de=a_partir_de,
+                             conta=conta)
+    try:
+        for pagina in paginas:
+            if not _entregar(fila, pagina, parar):
+                return
+        _entregar(fila, _FIM, parar)
+    except Exception as e:
+        _entregar(fila, e, parar)
+    finally:
+        paginas.close()
+
+
+@cronometrado("sincronizar_produtos")
+def sincronizar_produtos(incremental: bool = True, progresso: Optional[Callable] = None,
+                         conta: str = CONTA_PADRAO, interromper: Optional[threading.Event] = None) -> dict:
+    """Busca as paginas do Omie da `conta` numa thread e grava cada uma assim que chega.
+
+    Cada pagina e gravada junto com o checkpoint na mesma transacao; se a sincronizacao cair
+    no meio, a proxima (com os mesmos filtros) recomeca da pagina seguinte. Com `interromper`
+    ligado, para antes de gravar a proxima pagina.
+    """
+    progresso = progresso or (lambda **_: None)
+    marca = ultima_sincronizacao(conta) if incremental else None
+    filtros = filtros_alterados_desde(marca) if marca else None
+    chave_checkpoint = chave_conta(CHECKPOINT_SINCRONIZACAO, conta)
+
+    checkpoint = checkpoint_pendente(filtros, conta)
+    if checkpoint:
+        # A marca final continua sendo o inicio da execucao interrompida
+        inicio = _ler_marca(checkpoint["inicio"])
+        a_partir_de = checkpoint["pagina"] + 1
+        progresso(retomada_da_pagina=a_partir_de)
+    else:
+        inicio = agora_omie()
+        a_partir_de = 1
+
+    fila = queue.Queue(maxsize=max(1, SYNC_FILA_PAGINAS))
+    parar = threading.Event()
+    produtor = threading.Thread(target=_produzir, args=(fila, parar, filtros, a_partir_de, conta),
+                                name="sincronizacao-omie", daemon=True)
+    produtor.start()
+    recebidos = gravados = 0
+    try:
+        while True:
+            item = fila.get()
+            if item is _FIM:
+                break
+            if isinstance(item, Exception):
+                raise item
+            pagina, total_paginas, produtos = item
+            if interromper is not None and interromper.is_set():
+                raise SincronizacaoInterrompida(f"Sincronizacao interrompida antes da pagina {pagina}")
+            novo_checkpoint = {
+                "inicio": inicio.isoformat(),
+                "filtros": filtros,
+                "registros_por_pagina": OMIE_REGISTROS_POR_PAGINA,
+                "pagina": pagina,
+                "total_paginas": total_paginas,
+            }
+            gravados_pagina = salvar_produtos(
+                produtos, estado={chave_checkpoint: json.dumps(novo_checkpoint)}, conta=conta)
+            recebidos += len(produtos)
+            gravados += gravados_pagina
+            PRODUTOS_RECEBIDOS.inc(len(produtos), conta=conta)
+            PRODUTOS_GRAVADOS.inc(gravados_pagina, conta=conta)
+            progresso(paginas_recebidas=pagina, total_paginas=total_paginas,
+                      produtos_recebidos=recebidos, linhas_gravadas=gravados)
+    finally:
+        parar.set()
+        produtor.join()
+
+    if gravados:
+        invalidar_agrupamento()
+        atualizar_indice(conta)
+    # A marca so avanca depois que todas as paginas foram gravadas
+    salvar_estado(chave_conta(MARCA_SINCRONIZACAO, conta), inicio.isoformat())
+    remover_estado(chave_checkpoint)
+
+    return {
+        "modo": "incremental" if filtros else "completo",
+        "produtos": recebidos,
+        "gravados": gravados,
+    }
@@ -0,0 +1,104 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, Optional
+
+TAREFAS_MAX_WORKERS = int(os.getenv("TAREFAS_MAX_WORKERS", "4"))
+# Por quanto tempo uma tarefa concluida continua consultavel em /jobs/{id}
+TAREFAS_RETENCAO_SEGUNDOS = int(os.getenv("TAREFAS_RETENCAO_SEGUNDOS", "3600"))
+
+PENDENTE = "pendente"
+EXECUTANDO = "executando"
+CONCLUIDA = "concluida"
+FALHOU = "falhou"
+
+
+class Tarefa:
+    def __init__(self, tipo: str, chave: Hashable):
+        self.id = uuid.uuid4().hex
+        self.tipo = tipo
+        self.chave = chave
+        self.estado = PENDENTE
+        self.progresso: Dict = {}
+        self.resultado = None
+        self.erro: Optional[str] = None
+        self.criada_em = time.time()
+        self.concluida_em: Optional[float] = None
+        self._fim = threading.Event()
+
+    def atualizar_progresso(self, **valores):
+        self.progresso = {**self.progresso, **valores}
+
+    def aguardar(self, timeout: Optional[float] = None) -> bool:
+        return self._fim.wait(timeout)
+
+    def como_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "tipo": self.tipo,
+            "estado": self.estado,
+            "progresso": self.progresso,
+            "resultado": self.resultado,
+            "erro": self.erro,
+            "criada_em": self.criada_em,
+            "concluida_em": self.concluida_em,
+        }
+
+
+_executor = ThreadPoolExecutor(max_workers=TAREFAS_MAX_WORKERS, thread_name_prefix="tarefa")
+_tarefas: Dict[str, Tarefa] = {}
+# Tarefas pendentes/em execucao por chave, para juntar submissoes repetidas
+_ativas: Dict[Hashable, Tarefa] = {}
+_lock = threading.Lock()
+
+
+def _limpar_concluidas():
+    limite = time.time() - TAREFAS_RETENCAO_SEGUNDOS
+    for id_tarefa in [i for i, t in _tarefas.items() if t.concluida_em and t.concluida_em < limite]:
+        del _tarefas[id_tarefa]
+
+
+def _executar(tarefa: Tarefa, funcao: Callable, args, kwargs):
+    tarefa.estado = EXECUTANDO
+    try:
+        tarefa.resultado = funcao(*args, progresso=tarefa.atualizar_progresso, **kwargs)
+        tarefa.estado = CONCLUIDA
+    except Exception as e:
+        tarefa.erro = str(e)
+        tarefa.estado = FALHOU
+    finally:
+        tarefa.concluida_em = time.time()
+        with _lock:
+            if _ativas.get(tarefa.chave) is tarefa:
+                del _ativas[tarefa.chave]
+        tarefa._fim.set()
+
+
+def submeter(tipo: str, funcao: Callable, *args, chave: Optional[Hashable] = None, **kwargs) -> Tarefa:
+    """Agenda `funcao(*args, progresso=..., **kwargs)` no pool de tarefas.
+
+    Se ja existe uma tarefa ativa com a mesma chave, ela e devolvida em vez de criar outra.
+    """
+    chave = tipo if chave is None else chave
+    with _lock:
+        _limpar_concluidas()
+        ativa = _ativas.get(chave)
+        if ativa is not None:
+            return ativa
+        tarefa = Tarefa(tipo, chave)
+        _tarefas[tarefa.id] = tarefa
+        _ativas[chave] = tarefa
+    _executor.submit(_executar, tarefa, funcao, args, kwargs)
+    return tarefa
+
+
+def tarefa_ativa(chave: Hashable) -> Optional[Tarefa]:
+    with _lock:
+        return _ativas.get(chave)
+
+
+def obter_tarefa(id_tarefa: str) -> Optional[Tarefa]:
+    with _lock:
+        return _tarefas.get(id_tarefa)
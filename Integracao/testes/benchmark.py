@@ -0,0 +1,166 @@
+"""Benchmark ponta a ponta do backend contra o Omie falso (testes/omie_fake.py).
+
+Para cada tamanho de catalogo sobe o Omie falso e o backend (uvicorn, processo separado, banco
+temporario) e mede /token, /sincronizar, /produtos e /agrupar. O resultado vai para um JSON
+para comparacao entre versoes:
+
+    python testes/benchmark.py --tamanhos 1000 10000 100000 --saida benchmark.json
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+from omie_fake import ServidorOmieFake
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _porta_livre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _percentil(valores, p: float) -> float:
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1, max(0, round(p / 100 * (len(ordenados) - 1))))
+    return ordenados[indice]
+
+
+def _resumo(latencias, duracao_total: float) -> dict:
+    return {
+        "requisicoes": len(latencias),
+        "vazao_rps": round(len(latencias) / duracao_total, 2) if duracao_total else None,
+        "p50_ms": round(_percentil(latencias, 50) * 1000, 2),
+        "p99_ms": round(_percentil(latencias, 99) * 1000, 2),
+        "media_ms": round(statistics.mean(latencias) * 1000, 2),
+    }
+
+
+def medir(funcao, requisicoes: int, concorrencia: int) -> dict:
+    def uma(_):
+        inicio = time.perf_counter()
+        r = funcao()
+        r.raise_for_status()
+        return time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concorrencia) as executor:
+        latencias = list(executor.map(uma, range(requisicoes)))
+    return _resumo(latencias, time.perf_counter() - inicio)
+
+
+class Backend:
+    def __init__(self, omie_url: str, diretorio: str):
+        self.porta = _porta_livre()
+        self.url = f"http://127.0.0.1:{self.porta}"
+        env = dict(os.environ,
+                   DB_PATH=os.path.join(diretorio, "benchmark.db"),
+                   MODELO_IA_PATH=os.path.join(diretorio, "modelo.joblib"),
+                   OMIE_URL=omie_url,
+                   OMIE_APP_KEY="benchmark", OMIE_APP_SECRET="benchmark",
+                   OMIE_MAX_REQ_POR_SEGUNDO="0",
+                   OMIE_REGISTROS_POR_PAGINA="500")
+        self.processo = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(self.porta), "--log-level", "warning"],
+            cwd=RAIZ, env=env,
+        )
+        limite = time.time() + 120
+        while time.time() < limite:
+            try:
+                if requests.get(self.url + "/", timeout=1).ok:
+                    return
+            except requests.ConnectionError:
+                time.sleep(0.2)
+        self.parar()
+        raise RuntimeError("backend nao respondeu")
+
+    def parar(self):
+        self.processo.terminate()
+        self.processo.wait(30)
+
+
+def executar(tamanho: int, requisicoes: int, concorrencia: int, latencia_omie: float) -> dict:
+    resultado = {"produtos": tamanho}
+    with tempfile.TemporaryDirectory() as diretorio, \
+            ServidorOmieFake(tamanho, latencia=latencia_omie) as omie:
+        backend = Backend(omie.url, diretorio)
+        try:
+            sessao = requests.Session()
+            sessao.post(backend.url + "/register", json={"username": "bench", "password": "bench"})
+            login = {"username": "bench", "password": "bench"}
+            resultado["token"] = medir(lambda: sessao.post(backend.url + "/token", data=login),
+                                       min(requisicoes, 50), concorrencia)
+            token = sessao.post(backend.url + "/token", data=login).json()["access_token"]
+            sessao.headers["Authorization"] = f"Bearer {token}"
+
+            inicio = time.perf_counter()
+            sessao.get(backend.url + "/sincronizar", params={"completo": "true"}).raise_for_status()
+            resultado["sincronizar_completo_s"] = round(time.perf_counter() - inicio, 3)
+            resultado["sincronizar_incremental"] = medir(
+                lambda: sessao.get(backend.url + "/sincronizar"), 5, 1)
+
+            resultado["produtos_pagina"] = medir(
+                lambda: sessao.get(backend.url + "/produtos", params={"limit": 100}), requisicoes, concorrencia)
+            inicio = time.perf_counter()
+            linhas = sum(1 for _ in sessao.get(backend.url + "/produtos", params={"formato": "ndjson"},
+                                               stream=True).iter_lines())
+            resultado["produtos_ndjson"] = {"linhas": linhas, "duracao_s": round(time.perf_counter() - inicio, 3)}
+            resultado["busca"] = medir(
+                lambda: sessao.get(backend.url + "/produtos/busca", params={"q": "pote 500ml"}),
+                requisicoes, concorrencia)
+
+            inicio = time.perf_counter()
+            sessao.get(backend.url + "/agrupar").raise_for_status()
+            resultado["agrupar_frio_s"] = round(time.perf_counter() - inicio, 3)
+            resultado["agrupar_quente"] = medir(lambda: sessao.get(backend.url + "/agrupar"),
+                                                min(requisicoes, 50), concorrencia)
+            resultado["chamadas_omie"] = omie.chamadas
+        finally:
+            backend.parar()
+    return resultado
+
+
+def _versao_git() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "desconhecida"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark do backend Omie + IA")
+    parser.add_argument("--tamanhos", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--requisicoes", type=int, default=200)
+    parser.add_argument("--concorrencia", type=int, default=8)
+    parser.add_argument("--latencia-omie", type=float, default=0.0)
+    parser.add_argument("--saida", default="benchmark_resultados.json")
+    args = parser.parse_args()
+
+    relatorio = {
+        "versao": _versao_git(),
+        "data": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "parametros": {"requisicoes": args.requisicoes, "concorrencia": args.concorrencia,
+                       "latencia_omie": args.latencia_omie},
+        "resultados": [],
+    }
+    for tamanho in args.tamanhos:
+        print(f"Catalogo com {tamanho} produtos...")
+        relatorio["resultados"].append(
+            executar(tamanho, args.requisicoes, args.concorrencia, args.latencia_omie))
+    with open(args.saida, "w") as arquivo:
+        json.dump(relatorio, arquivo, indent=2, ensure_ascii=False)
+    print(f"Resultados em {args.saida}")
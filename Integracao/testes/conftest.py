@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import catalogo
+import database
+
+
+@pytest.fixture
+def banco(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DB_PATH", str(tmp_path / "teste.db"))
+    # Copia em memoria sempre confere a versao: os testes gravam e leem em seguida
+    monkeypatch.setattr(catalogo, "CATALOGO_VERIFICACAO_SEGUNDOS", 0)
+    database.init_db()
+    return database
@@ -0,0 +1,183 @@
+"""Servidor local que imita o ListarProdutos do Omie, para testes e benchmarks sem credenciais.
+
+Uso avulso:
+    python testes/omie_fake.py --produtos 10000 --porta 8081
+e depois OMIE_URL=http://127.0.0.1:8081/api/v1/geral/produtos/ no backend.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TIPOS = ("Pote", "Balde", "Tampa", "Copo", "Frasco", "Bandeja", "Garrafa")
+MATERIAIS = ("PP", "PET", "PEAD", "PS")
+VOLUMES = ("100ml", "250ml", "500ml", "750ml", "1L", "2L", "3,6L", "5L", "10L", "20L")
+MOLDES = ("P", "M", "G", "GG")
+
+DATA_BASE = datetime(2024, 1, 1, 8, 0, 0)
+
+
+def gerar_produto(indice: int, alterado_em: datetime = DATA_BASE, versao: int = 0) -> dict:
+    # Deterministico pelo indice: o mesmo catalogo a cada execucao
+    tipo = TIPOS[indice % len(TIPOS)]
+    volume = VOLUMES[(indice // len(TIPOS)) % len(VOLUMES)]
+    material = MATERIAIS[(indice // 7) % len(MATERIAIS)]
+    descricao = f"{tipo} {material} {volume} linha {indice % 97}"
+    if versao:
+        descricao += f" rev{versao}"
+    return {
+        "codigo_produto": 1000000 + indice,
+        "codigo": f"PRD{indice:06d}",
+        "descricao": descricao,
+        "modelo": f"{tipo[:3].upper()}-{indice % 50:02d}",
+        "volumetria": volume,
+        "tamanho_molde": MOLDES[indice % len(MOLDES)],
+        "info": {"dAlt": alterado_em.strftime("%d/%m/%Y"), "hAlt": alterado_em.strftime("%H:%M:%S")},
+    }
+
+
+class CatalogoFake:
+    def __init__(self, total: int):
+        self.total = total
+        self._alterados = {}
+        self._lock = threading.Lock()
+
+    def alterar(self, indices, quando: datetime = None):
+        # O Omie registra as alteracoes no horario de Brasilia, sem offset
+        quando = quando or datetime.now(ZoneInfo("America/Sao_Paulo")).replace(tzinfo=None)
+        with self._lock:
+            for i in indices:
+                versao = self._alterados.get(i, (None, 0))[1] + 1
+                self._alterados[i] = (quando, versao)
+
+    def produto(self, indice: int) -> dict:
+        alterado_em, versao = self._alterados.get(indice, (DATA_BASE, 0))
+        return gerar_produto(indice, alterado_em, versao)
+
+    def indices(self, desde: datetime = None):
+        if desde is None:
+            return range(self.total)
+        with self._lock:
+            alterados = sorted(i for i, (quando, _) in self._alterados.items() if quando >= desde)
+        if DATA_BASE >= desde:
+            return range(self.total)
+        return alterados
+
+
+def _filtro_desde(param: dict):
+    data = param.get("filtrar_por_data_de")
+    if not data:
+        return None
+    hora = param.get("filtrar_por_hora_de", "00:00:00")
+    return datetime.strptime(f"{data} {hora}", "%d/%m/%Y %H:%M:%S")
+
+
+class ServidorOmieFake:
+    """Sobe o servidor numa thread; `latencia` em segundos e `taxa_erro` entre 0 e 1."""
+
+    def __init__(self, produtos: int = 1000, porta: int = 0, latencia: float = 0.0,
+                 taxa_erro: float = 0.0, erro: str = "redundante", semente: int = 42):
+        self.catalogo = CatalogoFake(produtos)
+        self.latencia = latencia
+        self.taxa_erro = taxa_erro
+        self.erro = erro
+        self.chamadas = 0
+        self.erros_injetados = 0
+        self._random = random.Random(semente)
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", porta), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._httpd.server_address[1]}/api/v1/geral/produtos/"
+
+    def _sortear_erro(self) -> bool:
+        with self._lock:
+            self.chamadas += 1
+            falhar = self.taxa_erro > 0 and self._random.random() < self.taxa_erro
+            if falhar:
+                self.erros_injetados += 1
+            return falhar
+
+    def listar_produtos(self, param: dict):
+        pagina = int(param.get("pagina", 1))
+        por_pagina = min(int(param.get("registros_por_pagina", 50)), 500)
+        indices = self.catalogo.indices(_filtro_desde(param))
+        total = len(indices)
+        if total == 0:
+            return 500, {"faultstring": f"ERROR: Não existem registros para a página [{pagina}]!",
+                         "faultcode": "SOAP-ENV:Client-5113"}
+        total_paginas = (total + por_pagina - 1) // por_pagina
+        inicio = (pagina - 1) * por_pagina
+        produtos = [self.catalogo.produto(i) for i in indices[inicio:inicio + por_pagina]]
+        return 200, {
+            "pagina": pagina,
+            "total_de_paginas": total_paginas,
+            "registros": len(produtos),
+            "total_de_registros": total,
+            "produto_servico_cadastro": produtos,
+        }
+
+    def _handler(self):
+        servidor = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                tamanho = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(tamanho) or b"{}")
+                if servidor.latencia:
+                    time.sleep(servidor.latencia)
+                if servidor._sortear_erro():
+                    if servidor.erro == "503":
+                        status, corpo = 503, {"erro": "indisponivel"}
+                    else:
+                        status, corpo = 500, {"faultstring": "ERROR: Consumo redundante detectado.",
+                                              "faultcode": "SOAP-ENV:Client-6"}
+                elif payload.get("call") == "ListarProdutos":
+                    status, corpo = servidor.listar_produtos((payload.get("param") or [{}])[0])
+                else:
+                    status, corpo = 500, {"faultstring": f"ERROR: metodo {payload.get('call')} nao suportado"}
+                dados = json.dumps(corpo).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(dados)))
+                self.end_headers()
+                self.wfile.write(dados)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def iniciar(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def parar(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.iniciar()
+
+    def __exit__(self, *exc):
+        self.parar()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor Omie falso (ListarProdutos)")
+    parser.add_argument("--produtos", type=int, default=1000)
+    parser.add_argument("--porta", type=int, default=8081)
+    parser.add_argument("--latencia", type=float, default=0.0)
+    parser.add_argument("--taxa-erro", type=float, default=0.0)
+    args = parser.parse_args()
+    servidor = ServidorOmieFake(args.produtos, args.porta, args.latencia, args.taxa_erro)
+    print(f"Omie falso com {args.produtos} produtos em {servidor.url}")
+    servidor._httpd.serve_forever()
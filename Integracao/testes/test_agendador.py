@@ -0,0 +1,103 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import agendador
+import sincronizacao
+from tarefas import submeter, PENDENTE
+
+
+def test_cron_proxima_execucao():
+    assert agendador.Cron("*/15 * * * *").proxima(datetime(2026, 3, 2, 10, 7, 30)) == datetime(2026, 3, 2, 10, 15)
+    assert agendador.Cron("0 3 * * *").proxima(datetime(2026, 3, 2, 3, 0)) == datetime(2026, 3, 3, 3, 0)
+    # Segunda a sexta, 6h e 18h; 2026-03-07 e um sabado
+    cron = agendador.Cron("30 6,18 * * 1-5")
+    assert cron.proxima(datetime(2026, 3, 6, 19, 0)) == datetime(2026, 3, 9, 6, 30)
+    with pytest.raises(ValueError):
+        agendador.Cron("61 * * * *")
+
+
+def test_intervalo_alinhado_ao_relogio(monkeypatch):
+    monkeypatch.setattr(agendador, "SYNC_CRON", "")
+    monkeypatch.setattr(agendador, "SYNC_INTERVALO_MINUTOS", 15)
+    # Workers que sobem em momentos diferentes do mesmo intervalo disparam juntos
+    primeiro = agendador.proxima_execucao(datetime(2026, 3, 2, 10, 0, 1))
+    assert primeiro == agendador.proxima_execucao(datetime(2026, 3, 2, 10, 14, 59))
+    assert primeiro > datetime(2026, 3, 2, 10, 14, 59)
+    assert primeiro.timestamp() % (15 * 60) == 0
+    assert agendador.proxima_execucao(primeiro) == primeiro + timedelta(minutes=15)
+
+
+def test_lease_e_exclusivo_entre_processos(banco):
+    assert banco.adquirir_lock("sync", "a", 60)
+    assert not banco.adquirir_lock("sync", "b", 60)
+    assert banco.adquirir_lock("sync", "a", 60)
+    banco.liberar_lock("sync", "b")
+    assert banco.dono_lock("sync") == "a"
+    banco.liberar_lock("sync", "a")
+    assert banco.adquirir_lock("sync", "b", -1)
+    # Lease vencido pode ser tomado por outro dono
+    assert banco.dono_lock("sync") is None
+    assert banco.adquirir_lock("sync", "a", 60)
+
+
+def test_sincronizar_exclusivo_respeita_lock_e_disparo_ja_atendido(banco, monkeypatch):
+    chamadas = []
+    monkeypatch.setattr(agendador, "sincronizar_produtos",
+                        lambda **kwargs: chamadas.append(kwargs) or {"modo": "incremental"})
+
+    banco.adquirir_lock(agendador.LOCK_SINCRONIZACAO, "outro-worker", 60)
+    assert agendador.sincronizacao_em_outro_processo()
+    with pytest.raises(agendador.SincronizacaoEmAndamento):
+        agendador.sincronizar_exclusivo()
+    banco.liberar_lock(agendador.LOCK_SINCRONIZACAO, "outro-worker")
+
+    assert agendador.sincronizar_exclusivo()["modo"] == "incremental"
+    assert banco.dono_lock(agendador.LOCK_SINCRONIZACAO) is None
+
+    banco.salvar_estado(sincronizacao.MARCA_SINCRONIZACAO, "2026-03-02T10:00:05-03:00")
+    resultado = agendador.sincronizar_exclusivo(nao_antes_de=datetime(2026, 3, 2, 13, 0, tzinfo=timezone.utc))
+    assert resultado["modo"] == "ignorada"
+    assert len(chamadas) == 1
+
+
+def test_completa_nao_roda_junto_com_incremental_da_mesma_conta(banco, monkeypatch):
+    liberar = threading.Event()
+    monkeypatch.setattr(agendador, "sincronizar_produtos",
+                        lambda **kwargs: liberar.wait(5) and {"modo": "incremental"})
+    incremental = submeter("sincronizar", agendador.sincronizar_exclusivo, incremental=True,
+                           chave=agendador.chave_sincronizacao("padrao", True))
+    while incremental.estado == PENDENTE:
+        time.sleep(0.01)
+    # Mesmo dono no lease: so o lock local impede a segunda execucao
+    completa = submeter("sincronizar", agendador.sincronizar_exclusivo, incremental=False,
+                        chave=agendador.chave_sincronizacao("padrao", False))
+    assert completa is not incremental
+    completa.aguardar(5)
+    assert completa.erro == agendador.MENSAGEM_EM_ANDAMENTO
+    liberar.set()
+    incremental.aguardar(5)
+    assert incremental.resultado == {"modo": "incremental"}
+
+
+def test_lease_perdido_interrompe_a_sincronizacao(banco, monkeypatch):
+    monkeypatch.setattr(agendador, "SYNC_LOCK_SEGUNDOS", 0.06)
+    monkeypatch.setattr(agendador, "renovar_lock", lambda *args: False)
+
+    def sincronizar(interromper, **kwargs):
+        assert interromper.wait(5)
+        raise sincronizacao.SincronizacaoInterrompida("interrompida")
+
+    monkeypatch.setattr(agendador, "sincronizar_produtos", sincronizar)
+    with pytest.raises(sincronizacao.SincronizacaoInterrompida):
+        agendador.sincronizar_exclusivo()
+
+
+def test_cron_invalida_falha_no_startup(monkeypatch):
+    monkeypatch.setattr(agendador, "SYNC_CRON", "*/15 * * *")
+    with pytest.raises(ValueError):
+        agendador.validar_configuracao()
+    monkeypatch.setattr(agendador, "SYNC_CRON", "")
+    agendador.validar_configuracao()
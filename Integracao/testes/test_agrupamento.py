@@ -0,0 +1,133 @@
+import pytest
+
+import enumeracaoIA
+
+
+@pytest.fixture(autouse=True)
+def sem_pool(monkeypatch):
+    # Calculo no proprio processo; os testes do pool ligam AGRUPAMENTO_PROCESSOS explicitamente
+    monkeypatch.setattr(enumeracaoIA, "AGRUPAMENTO_PROCESSOS", 0)
+    yield
+    enumeracaoIA.encerrar_processos()
+
+
+def _produtos(n, prefixo="Pote"):
+    return [{"codigo_produto": i, "descricao": f"{prefixo} {i % 3} redondo", "modelo": f"M{i % 2}",
+             "volumetria": f"{(i % 4) * 250}ml", "tamanho_molde": "G"} for i in range(n)]
+
+
+def test_agrupamento_reaproveita_resultado_ate_o_catalogo_mudar(banco):
+    enumeracaoIA.invalidar_agrupamento()
+    banco.salvar_produtos(_produtos(30))
+    primeiro = enumeracaoIA.agrupar_catalogo()
+    assert sum(len(g) for g in primeiro["grupos"].values()) == 30
+    assert enumeracaoIA.agrupar_catalogo() is primeiro
+    assert enumeracaoIA.agrupar_catalogo(n_clusters=3) is not primeiro
+
+    banco.salvar_produtos(_produtos(30))
+    assert enumeracaoIA.agrupar_catalogo() is primeiro
+
+    banco.salvar_produtos(_produtos(35, "Balde"))
+    assert enumeracaoIA.agrupar_catalogo() is not primeiro
+
+
+def test_modo_incremental_persiste_e_incorpora_alterados(banco, tmp_path, monkeypatch):
+    monkeypatch.setattr(enumeracaoIA, "MODELO_IA_PATH", str(tmp_path / "modelo.joblib"))
+    banco.salvar_produtos(_produtos(40))
+    grupos = enumeracaoIA.agrupar_produtos(banco.buscar_todos_produtos(), modo="incremental")
+    assert sum(len(g) for g in grupos.values()) == 40
+    estado = enumeracaoIA.carregar_modelo()
+    passos = estado["modelo"].n_steps_
+
+    banco.salvar_produtos(_produtos(42))
+    grupos = enumeracaoIA.agrupar_produtos(banco.buscar_todos_produtos(), modo="incremental")
+    assert sum(len(g) for g in grupos.values()) == 42
+    estado = enumeracaoIA.carregar_modelo()
+    assert estado["modelo"].n_steps_ > passos
+    assert len(estado["hashes"]) == 42
+
+
+def test_agrupamento_persistido_com_rotulos_e_consultas_por_grupo(banco):
+    enumeracaoIA.invalidar_agrupamento()
+    banco.salvar_produtos(_produtos(30) + _produtos(60, "Balde")[30:])
+    resultado = enumeracaoIA.agrupar_catalogo(n_clusters=2)
+
+    grupos = banco.listar_grupos()
+    assert [g["id"] for g in grupos] == [1, 2]
+    assert sum(g["total"] for g in grupos) == 60
+    assert all(g["termos"] and g["rotulo"] for g in grupos)
+    assert banco.obter_agrupamento() == {"versao_catalogo": banco.versao_catalogo(),
+                                         "n_clusters": 2, "modo": "completo"}
+
+    for grupo in grupos:
+        membros = resultado["grupos"][f"grupo_{grupo['id']}"]
+        pagina = banco.buscar_produtos_grupo(grupo["id"], limite=10, campos=["codigo"])
+        assert [p["id"] for p in pagina] == sorted(p["id"] for p in membros)[:10]
+        resto = banco.buscar_produtos_grupo(grupo["id"], apos_id=pagina[-1]["id"], limite=1000)
+        assert len(pagina) + len(resto) == grupo["total"]
+
+    codigo = resultado["grupos"]["grupo_2"][0]["codigo"]
+    assert banco.buscar_grupo_produto(codigo)["id"] == 2
+    assert banco.buscar_grupo_produto("inexistente") is None
+
+
+def test_pool_de_processos_equivale_ao_calculo_local(monkeypatch):
+    produtos = _produtos(40) + _produtos(40, "Balde")
+    monkeypatch.setattr(enumeracaoIA, "AGRUPAMENTO_PROCESSOS", 0)
+    local = enumeracaoIA.calcular_agrupamento(produtos, 3)
+    monkeypatch.setattr(enumeracaoIA, "AGRUPAMENTO_PROCESSOS", 2)
+    try:
+        em_processos = enumeracaoIA.calcular_agrupamento(produtos, 3)
+    finally:
+        enumeracaoIA.encerrar_processos()
+    assert list(local["labels"]) == list(em_processos["labels"])
+    assert local["termos"] == em_processos["termos"]
+
+
+def test_timeout_devolve_ultimo_resultado_bom(banco, monkeypatch):
+    enumeracaoIA.invalidar_agrupamento()
+    banco.salvar_produtos(_produtos(30))
+    bom = enumeracaoIA.agrupar_catalogo(n_clusters=2)
+
+    banco.salvar_produtos(_produtos(30, "Balde"))
+    monkeypatch.setattr(enumeracaoIA, "AGRUPAMENTO_PROCESSOS", 1)
+    monkeypatch.setattr(enumeracaoIA, "AGRUPAMENTO_TIMEOUT", 1e-6)
+    try:
+        resultado = enumeracaoIA.agrupar_catalogo(n_clusters=2)
+        # O pool ocupado pelos reinicios que estouraram o tempo foi descartado
+        assert enumeracaoIA._pool is None
+    finally:
+        enumeracaoIA.encerrar_processos()
+    assert resultado["desatualizado"] is True
+    assert resultado["grupos"] == bom["grupos"]
+
+
+def test_ultimos_resultados_sao_limitados(banco):
+    enumeracaoIA.invalidar_agrupamento()
+    banco.salvar_produtos([{"codigo_produto": i, "descricao": f"item{i} linha{i % 7}"} for i in range(30)])
+    for n in range(2, 2 + enumeracaoIA.AGRUPAMENTO_CACHE_ITENS + 5):
+        enumeracaoIA.agrupar_catalogo(n_clusters=n)
+    assert len(enumeracaoIA._ultimos_resultados) <= enumeracaoIA.AGRUPAMENTO_CACHE_ITENS
+
+
+def test_catalogo_com_um_produto_nos_dois_modos(banco, tmp_path, monkeypatch):
+    monkeypatch.setattr(enumeracaoIA, "MODELO_IA_PATH", str(tmp_path / "modelo.joblib"))
+    enumeracaoIA.invalidar_agrupamento()
+    banco.salvar_produtos(_produtos(1))
+    for modo in ("completo", "incremental"):
+        assert enumeracaoIA.agrupar_catalogo(modo=modo)["total_grupos"] == 1
+
+
+def test_grupos_nao_expoem_o_hash_interno(banco):
+    enumeracaoIA.invalidar_agrupamento()
+    banco.salvar_produtos(_produtos(12))
+    resultado = enumeracaoIA.agrupar_catalogo(n_clusters=2)
+    for grupo in resultado["grupos"].values():
+        for produto in grupo:
+            assert set(produto) == set(banco.CAMPOS_PRODUTO)
+
+
+def test_caminho_modelo_sem_sufixo_e_da_conta_legada(monkeypatch):
+    monkeypatch.setattr(enumeracaoIA, "MODELO_IA_PATH", "modelo.joblib")
+    assert enumeracaoIA.caminho_modelo("padrao") == "modelo.joblib"
+    assert enumeracaoIA.caminho_modelo("empresa_a") == "modelo.empresa_a.joblib"
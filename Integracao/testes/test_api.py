@@ -0,0 +1,69 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+import respostas
+
+
+@pytest.fixture
+def cliente(banco):
+    main.app.dependency_overrides[main.get_current_user] = lambda: {"username": "teste"}
+    with TestClient(main.app) as cliente:
+        yield cliente
+    main.app.dependency_overrides.clear()
+
+
+def test_agrupar_limita_n_clusters(cliente):
+    assert cliente.get("/agrupar", params={"n_clusters": main.AGRUPAMENTO_CLUSTERS_MAXIMO + 1}).status_code == 422
+    assert cliente.get("/agrupar", params={"n_clusters": 1}).status_code == 422
+
+
+def _produtos(n):
+    return [{"codigo_produto": i, "descricao": f"Pote {i} redondo", "modelo": "M1",
+             "volumetria": "500ml", "tamanho_molde": "G"} for i in range(n)]
+
+
+def test_produtos_repetido_com_if_none_match_devolve_304(cliente, banco):
+    banco.salvar_produtos(_produtos(3))
+    primeira = cliente.get("/produtos")
+    etag = primeira.headers["etag"]
+    segunda = cliente.get("/produtos", headers={"If-None-Match": etag})
+    assert segunda.status_code == 304
+    assert segunda.headers["etag"] == etag
+
+
+def test_etag_muda_depois_de_salvar_produtos(cliente, banco):
+    banco.salvar_produtos(_produtos(3))
+    antes = cliente.get("/produtos").headers["etag"]
+    banco.salvar_produtos([{"codigo_produto": 99, "descricao": "Balde novo"}])
+    resposta = cliente.get("/produtos", headers={"If-None-Match": antes})
+    assert resposta.status_code == 200
+    assert resposta.headers["etag"] != antes
+
+
+def test_agrupar_desatualizado_nao_tem_etag(cliente, monkeypatch):
+    monkeypatch.setattr(main, "agrupar_catalogo",
+                        lambda *args, **kwargs: {"total_grupos": 0, "grupos": {}, "desatualizado": True})
+    resposta = cliente.get("/agrupar")
+    assert resposta.status_code == 200
+    assert resposta.json()["desatualizado"] is True
+    assert "etag" not in resposta.headers
+
+
+def test_resposta_grande_sai_comprimida(cliente, banco):
+    banco.salvar_produtos(_produtos(50))
+    grande = cliente.get("/produtos", headers={"Accept-Encoding": "gzip"})
+    assert len(grande.content) > respostas.COMPRESSAO_TAMANHO_MINIMO
+    assert grande.headers["content-encoding"] == "gzip"
+    pequena = cliente.get("/produtos", params={"limit": 1, "campos": "codigo"},
+                          headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in pequena.headers
+
+
+def test_lote_mantem_ordem_remove_repetidos_e_aceita_codigos_numericos(cliente, banco):
+    banco.salvar_produtos(_produtos(5))
+    resposta = cliente.post("/produtos/lote", json={"codigos": [3, "1", "404", "3", 1], "campos": ["codigo"]})
+    assert resposta.status_code == 200
+    corpo = resposta.json()
+    assert [p["codigo"] for p in corpo["dados"]] == ["3", "1"]
+    assert corpo["nao_encontrados"] == ["404"]
@@ -0,0 +1,38 @@
+import asyncio
+from datetime import timedelta
+
+from passlib.hash import bcrypt
+
+import autenticacao
+
+
+def test_token_decodificado_uma_unica_vez(monkeypatch):
+    token = autenticacao.create_access_token({"sub": "ana"}, timedelta(minutes=5))
+    chamadas = []
+    original = autenticacao.decode_access_token
+    monkeypatch.setattr(autenticacao, "decode_access_token", lambda t: chamadas.append(t) or original(t))
+
+    assert autenticacao.decode_access_token_cached(token)["sub"] == "ana"
+    assert autenticacao.decode_access_token_cached(token)["sub"] == "ana"
+    assert chamadas == [token]
+
+
+def test_usuario_desativado_sai_do_cache(banco):
+    banco.create_user("bia", "hash")
+    assert autenticacao.get_cached_user("bia") is None
+    assert autenticacao.get_active_user("bia")["username"] == "bia"
+    assert autenticacao.get_cached_user("bia")["username"] == "bia"
+
+    autenticacao.set_user_status("bia", False)
+    assert autenticacao.get_cached_user("bia") is None
+    assert autenticacao.get_active_user("bia") is None
+
+
+def test_hash_com_custo_antigo_e_refeito_fora_do_event_loop():
+    antigo = bcrypt.using(rounds=4).hash("segredo")
+    valido, novo = asyncio.run(autenticacao.verify_and_update_password_async("segredo", antigo))
+    assert valido
+    assert novo is not None and bcrypt.from_string(novo).rounds == autenticacao.BCRYPT_ROUNDS
+
+    valido, novo = asyncio.run(autenticacao.verify_and_update_password_async("errada", antigo))
+    assert not valido and novo is None
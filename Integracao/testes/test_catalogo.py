@@ -0,0 +1,45 @@
+import json
+
+import pytest
+
+import catalogo
+
+
+def _produtos(n, sufixo=""):
+    return [{"codigo_produto": i, "descricao": f"Pote {i}{sufixo}", "modelo": "M1",
+             "volumetria": "500ml", "tamanho_molde": "G"} for i in range(n)]
+
+
+def _pagina_do_banco(banco, apos, limite, campos=None):
+    campos = ["id"] + campos if campos else banco.CAMPOS_PRODUTO
+    produtos = [p for p in banco.buscar_todos_produtos() if p["id"] > apos][:limite]
+    return [{c: p[c] for c in campos} for p in produtos]
+
+
+def test_copia_em_memoria_igual_ao_banco_e_trocada_por_versao(banco):
+    banco.salvar_produtos(_produtos(25))
+    copia = catalogo.obter_catalogo()
+    assert copia.versao == banco.versao_catalogo() and len(copia) == 25
+    assert catalogo.obter_catalogo() is copia
+
+    pagina = json.loads(copia.pagina_json(0, 10))
+    assert pagina["dados"] == _pagina_do_banco(banco, 0, 10)
+    assert pagina["proximo_cursor"] == pagina["dados"][-1]["id"]
+    ultima = json.loads(copia.pagina_json(20, 10))
+    assert ultima["dados"] == _pagina_do_banco(banco, 20, 10) and ultima["proximo_cursor"] is None
+
+    dados, proximo = copia.pagina(5, 3, ["descricao"])
+    assert dados == _pagina_do_banco(banco, 5, 3, ["descricao"]) and proximo == dados[-1]["id"]
+    assert [json.loads(linha) for linha in copia.linhas_ndjson(22)] == _pagina_do_banco(banco, 22, 10)
+    assert copia.por_ids([3, 999, 1], ["codigo"]) == [{"id": 3, "codigo": "2"}, {"id": 1, "codigo": "0"}]
+    with pytest.raises(ValueError):
+        copia.pagina(0, 10, ["senha"])
+
+    banco.salvar_produtos(_produtos(25))
+    assert catalogo.obter_catalogo() is copia
+    banco.salvar_produtos(_produtos(3, " tampa"))
+    nova = catalogo.obter_catalogo()
+    assert nova is not copia and nova.versao == copia.versao + 1
+    assert nova.por_ids([1], ["descricao"]) == [{"id": 1, "descricao": "Pote 0 tampa"}]
+    # Quem ja tinha a copia anterior continua vendo o estado antigo
+    assert copia.por_ids([1], ["descricao"]) == [{"id": 1, "descricao": "Pote 0"}]
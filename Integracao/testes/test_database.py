@@ -0,0 +1,98 @@
+import sqlite3
+import threading
+
+import pytest
+
+
+def _produto(codigo, descricao="Pote 500ml"):
+    return {"codigo_produto": codigo, "descricao": descricao, "modelo": "PT",
+            "volumetria": "500ml", "tamanho_molde": "M"}
+
+
+def test_salvar_produtos_e_idempotente(banco):
+    assert banco.salvar_produtos([_produto(1), _produto(2)]) == 2
+    assert banco.salvar_produtos([_produto(1), _produto(2)]) == 0
+    assert len(banco.buscar_todos_produtos()) == 2
+
+
+def test_salvar_produtos_atualiza_somente_alterados(banco):
+    banco.salvar_produtos([_produto(1), _produto(2)])
+    assert banco.salvar_produtos([_produto(1, "Pote 750ml"), _produto(2)]) == 1
+    descricoes = {p["codigo"]: p["descricao"] for p in banco.buscar_todos_produtos()}
+    assert descricoes == {"1": "Pote 750ml", "2": "Pote 500ml"}
+
+
+def test_migracao_remove_duplicados(tmp_path, monkeypatch, banco):
+    caminho = str(tmp_path / "antigo.db")
+    conn = sqlite3.connect(caminho)
+    conn.execute("""CREATE TABLE produtos (id INTEGER PRIMARY KEY AUTOINCREMENT, codigo TEXT,
+                    descricao TEXT, modelo TEXT, volumetria TEXT, tamanho_molde TEXT)""")
+    conn.executemany("INSERT INTO produtos (codigo, descricao) VALUES (?, ?)",
+                     [("1", "antigo"), ("2", "b"), ("1", "novo")])
+    conn.commit()
+    conn.close()
+
+    monkeypatch.setattr(banco, "DB_PATH", caminho)
+    banco.init_db()
+    produtos = banco.buscar_todos_produtos()
+    assert sorted((p["codigo"], p["descricao"]) for p in produtos) == [("1", "novo"), ("2", "b")]
+
+
+def test_conta_legada_passa_para_a_conta_padrao_configurada(banco):
+    banco.salvar_produtos([_produto(1), _produto(2)], conta="padrao")
+    banco.salvar_estado(banco.chave_conta("ultima_sincronizacao", "padrao"), "2026-03-02T10:00:00-03:00")
+    with banco.get_conn() as conn:
+        # "padrao" continua configurada: nada muda
+        banco.realocar_conta_legada(conn.cursor(), "matriz", ["padrao", "matriz"])
+        assert banco.buscar_todos_produtos(conta="matriz") == []
+        banco.realocar_conta_legada(conn.cursor(), "matriz", ["matriz", "filial"])
+    assert len(banco.buscar_todos_produtos(conta="matriz")) == 2
+    assert banco.buscar_todos_produtos(conta="padrao") == []
+    assert banco.versao_catalogo("matriz") == 1
+    assert banco.obter_estado(banco.chave_conta("ultima_sincronizacao", "matriz")) == "2026-03-02T10:00:00-03:00"
+    assert len(banco.buscar_produtos_texto("pote", conta="matriz")) == 2
+
+
+def test_conexao_por_thread_em_wal(banco):
+    conn = banco.get_conn()
+    assert banco.get_conn() is conn
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    outras = []
+    t = threading.Thread(target=lambda: outras.append(banco.get_conn()))
+    t.start()
+    t.join()
+    assert outras[0] is not conn
+
+
+def test_catalogo_lido_em_ordem_de_id_com_a_versao(banco):
+    banco.salvar_produtos([_produto(i) for i in range(1, 6)])
+    versao, linhas = banco.ler_catalogo()
+    assert versao == banco.versao_catalogo() == 1
+    assert [linha[banco.CAMPOS_PRODUTO.index("codigo")] for linha in linhas] == ["1", "2", "3", "4", "5"]
+    assert len(linhas[0]) == len(banco.CAMPOS_PRODUTO) + 1
+    assert banco.ler_catalogo(conta="filial") == (0, [])
+
+
+def test_projecao_rejeita_coluna_desconhecida(banco):
+    with pytest.raises(ValueError):
+        banco.buscar_produtos_por_codigos(["1"], ["codigo", "hash; DROP TABLE produtos"])
+
+
+def test_busca_texto_acompanha_upsert(banco):
+    banco.salvar_produtos([_produto(1, "Pote Redondo"), _produto(2, "Balde Quadrado")])
+    assert [p["codigo"] for p in banco.buscar_produtos_texto("redond")] == ["1"]
+
+    banco.salvar_produtos([_produto(1, "Tampa Oval")])
+    assert banco.buscar_produtos_texto("redondo") == []
+    assert [p["codigo"] for p in banco.buscar_produtos_texto("tampa oval")] == ["1"]
+    assert banco.buscar_produtos_texto('"*') == []
+
+
+def test_busca_por_codigos_em_lotes(banco, monkeypatch):
+    monkeypatch.setattr(banco, "SQLITE_LOTE_IN", 3)
+    banco.salvar_produtos([_produto(i, f"Pote {i}") for i in range(10)])
+    encontrados = banco.buscar_produtos_por_codigos(["7", "x", "1", "7", "9", "0", "4", "y"], ["descricao"])
+    assert set(encontrados) == {"7", "1", "9", "0", "4"}
+    assert encontrados["9"] == {"id": 10, "descricao": "Pote 9"}
+    assert banco.buscar_produtos_por_codigos([]) == {}
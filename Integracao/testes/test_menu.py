@@ -0,0 +1,35 @@
+import json
+import os
+
+import menu
+from autenticacao import PWD_CONTEXT
+
+
+def test_arquivo_de_usuarios_e_relido_somente_quando_muda(tmp_path):
+    caminho = tmp_path / "usuarios.json"
+    caminho.write_text(json.dumps([{"nome": "ana", "senha_hash": PWD_CONTEXT.hash("123")}]))
+    usuarios = menu.UsuariosArquivo(str(caminho))
+    assert usuarios.buscar("ana")["nome"] == "ana"
+    assert usuarios.buscar("bia") is None
+
+    caminho.write_text(json.dumps([{"nome": "bia", "senha": "456"}]))
+    os.utime(caminho, ns=(0, os.stat(caminho).st_mtime_ns + 1_000_000))
+    assert usuarios.buscar("ana") is None
+    assert usuarios.buscar("bia")["senha"] == "456"
+
+
+def test_login_com_senha_em_hash(tmp_path, monkeypatch):
+    caminho = tmp_path / "usuarios.json"
+    caminho.write_text(json.dumps([{"nome": "ana", "senha_hash": PWD_CONTEXT.hash("123")}]))
+    monkeypatch.setattr(menu, "usuarios_arquivo", menu.UsuariosArquivo(str(caminho)))
+    assert menu.verificar_usuario("ana", "123")
+    assert not menu.verificar_usuario("ana", "errada")
+
+
+def test_login_com_senha_em_texto_puro_aceita_acentos(tmp_path, monkeypatch):
+    caminho = tmp_path / "usuarios.json"
+    caminho.write_text(json.dumps([{"nome": "bia", "senha": "sénha"}]))
+    monkeypatch.setattr(menu, "usuarios_arquivo", menu.UsuariosArquivo(str(caminho)))
+    assert menu.verificar_usuario("bia", "sénha")
+    assert not menu.verificar_usuario("bia", "senha")
+    assert not menu.verificar_usuario("bia", "çenha")
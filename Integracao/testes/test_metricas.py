@@ -0,0 +1,23 @@
+import metricas
+
+
+def test_histograma_renderiza_buckets_cumulativos():
+    histograma = metricas.Histograma("teste_duracao_segundos", "Teste", ("rota",), buckets=(0.1, 1))
+    histograma.observar(0.05, rota="/a")
+    histograma.observar(0.5, rota="/a")
+    histograma.observar(5, rota="/a")
+
+    texto = histograma.renderizar()
+    assert '# TYPE teste_duracao_segundos histogram' in texto
+    assert 'teste_duracao_segundos_bucket{rota="/a",le="0.1"} 1' in texto
+    assert 'teste_duracao_segundos_bucket{rota="/a",le="1"} 2' in texto
+    assert 'teste_duracao_segundos_bucket{rota="/a",le="+Inf"} 3' in texto
+    assert 'teste_duracao_segundos_count{rota="/a"} 3' in texto
+    assert 'teste_duracao_segundos_sum{rota="/a"} 5.55' in texto
+
+
+def test_contador_escapa_rotulos():
+    contador = metricas.Contador("teste_total", "Teste", ("nome",))
+    contador.inc(nome='a"b')
+    contador.inc(2, nome='a"b')
+    assert 'teste_total{nome="a\\"b"} 3' in contador.renderizar()
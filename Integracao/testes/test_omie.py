@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+
+import omieAPI
+from omie_fake import ServidorOmieFake
+
+
+class _Resposta:
+    def __init__(self, status, corpo):
+        self.status_code = status
+        self._corpo = corpo
+
+    def json(self):
+        return self._corpo
+
+
+def _cliente(respostas, monkeypatch):
+    monkeypatch.setattr(omieAPI, "_espera_backoff", lambda tentativa: 0)
+    cliente = omieAPI.OmieClient("chave", "segredo", max_tentativas=3,
+                                 limitador=omieAPI.BaldeTokens(0))
+    chamadas = []
+
+    def post(url, json, timeout):
+        chamadas.append(json)
+        return respostas.pop(0)
+
+    monkeypatch.setattr(cliente.session, "post", post)
+    return cliente, chamadas
+
+
+def test_repete_consumo_redundante(monkeypatch):
+    cliente, chamadas = _cliente([
+        _Resposta(500, {"faultstring": "ERROR: Consumo redundante detectado."}),
+        _Resposta(200, {"total_de_paginas": 1, "produto_servico_cadastro": [{"codigo": "A"}]}),
+    ], monkeypatch)
+    assert cliente.listar_produtos()["produto_servico_cadastro"] == [{"codigo": "A"}]
+    assert len(chamadas) == 2
+
+
+def test_falha_definitiva_nao_e_repetida(monkeypatch):
+    cliente, chamadas = _cliente([_Resposta(500, {"faultstring": "ERROR: app_key invalida"})], monkeypatch)
+    try:
+        cliente.listar_produtos()
+        assert False, "esperava ErroOmie"
+    except omieAPI.ErroOmie as e:
+        assert not e.temporario
+    assert len(chamadas) == 1
+
+
+def test_filtro_sem_registros_vira_pagina_vazia(monkeypatch):
+    cliente, _ = _cliente([
+        _Resposta(500, {"faultstring": "ERROR: Não existem registros para a página [1]!"}),
+    ], monkeypatch)
+    assert list(cliente.iterar_paginas(filtros={"filtrar_por_data_de": "01/01/2026"})) == [(1, 1, [])]
+
+
+def test_balde_de_tokens_libera_rajada_e_depois_espaca():
+    balde = omieAPI.BaldeTokens(por_segundo=10, capacidade=2)
+    assert balde.reservar() == 0
+    assert balde.reservar() == 0
+    assert 0.05 < balde.reservar() <= 0.1
+
+
+def _cliente_async(servidor, monkeypatch):
+    monkeypatch.setattr(omieAPI, "_espera_backoff", lambda tentativa: 0)
+    monkeypatch.setattr(omieAPI, "OMIE_URL", servidor.url)
+    return omieAPI.OmieClientAsync("chave", "segredo", max_tentativas=10, limitador=omieAPI.BaldeTokens(0))
+
+
+async def _com_cliente(cliente, chamada):
+    try:
+        return await chamada(cliente)
+    finally:
+        await cliente.fechar()
+
+
+def test_cliente_async_repete_erros_temporarios(monkeypatch):
+    with ServidorOmieFake(produtos=250, taxa_erro=0.3, erro="503") as servidor:
+        cliente = _cliente_async(servidor, monkeypatch)
+        produtos = asyncio.run(_com_cliente(cliente, lambda c: c.get_todos_produtos(registros_por_pagina=50)))
+    assert len({p["codigo"] for p in produtos}) == 250
+    assert servidor.erros_injetados > 0
+
+
+def test_cliente_async_sem_registros_e_falha_definitiva(monkeypatch):
+    with ServidorOmieFake(produtos=10) as servidor:
+        cliente = _cliente_async(servidor, monkeypatch)
+        filtros = {"filtrar_por_data_de": "01/01/2099", "filtrar_por_hora_de": "00:00:00"}
+        assert asyncio.run(_com_cliente(cliente, lambda c: c.get_todos_produtos(filtros=filtros))) == []
+
+        cliente = _cliente_async(servidor, monkeypatch)
+        chamadas = servidor.chamadas
+        with pytest.raises(omieAPI.ErroOmie) as erro:
+            asyncio.run(_com_cliente(cliente, lambda c: c.chamar(servidor.url, "ExcluirProduto", {})))
+        assert not erro.value.temporario
+        assert servidor.chamadas - chamadas == 1
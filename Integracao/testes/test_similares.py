@@ -0,0 +1,35 @@
+import catalogo
+import similares
+
+
+def _produto(i, descricao, volumetria="500ml", molde="M"):
+    return {"codigo_produto": i, "descricao": descricao, "modelo": f"MOD{i}",
+            "volumetria": volumetria, "tamanho_molde": molde}
+
+
+def test_similares_por_cosseno_e_atualizacao_incremental(banco):
+    similares.limpar_indice()
+    assert similares.buscar_similares("1") is None
+
+    produtos = [_produto(i, "Pote redondo PP", "500ml") for i in range(1, 6)]
+    produtos += [_produto(i, "Balde tampa PEAD", "20L", "GG") for i in range(6, 21)]
+    banco.salvar_produtos(produtos)
+
+    vizinhos = similares.buscar_similares("1", k=4)
+    ids = [i for i, _ in vizinhos]
+    assert len(ids) == 4 and 1 not in ids
+    potes = {p["id"] for p in catalogo.obter_catalogo().por_ids(ids, ["codigo"]) if int(p["codigo"]) <= 5}
+    assert potes == set(ids)
+    assert [s for _, s in vizinhos] == sorted((s for _, s in vizinhos), reverse=True)
+    indice = similares.obter_indice()
+
+    # Um produto alterado: o indice reaproveita o vocabulario e recalcula so a linha dele
+    banco.salvar_produtos([_produto(20, "Pote redondo PP", "500ml")])
+    similares.atualizar_indice()
+    atualizado = similares.obter_indice()
+    assert atualizado is not indice and atualizado.vectorizer is indice.vectorizer
+    assert atualizado.matriz.shape == indice.matriz.shape
+    assert "20" in [catalogo.obter_catalogo().por_ids([i])[0]["codigo"]
+                    for i, _ in similares.buscar_similares("1", k=5)]
+    assert similares.buscar_similares("inexistente") is None
+    similares.limpar_indice()
@@ -0,0 +1,151 @@
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import pytest
+
+import catalogo
+import contas
+import metricas
+import omieAPI
+import sincronizacao
+from omie_fake import ServidorOmieFake
+
+
+@pytest.fixture
+def duas_contas(monkeypatch):
+    monkeypatch.setattr(contas, "CONTAS", {"padrao": {}, "filial": {}})
+    monkeypatch.setattr(omieAPI, "_clientes", {})
+
+
+@pytest.fixture
+def omie(monkeypatch):
+    def iniciar(**opcoes):
+        servidor = ServidorOmieFake(**opcoes).iniciar()
+        servidores.append(servidor)
+        monkeypatch.setattr(omieAPI, "OMIE_URL", servidor.url)
+        for conta in contas.CONTAS:
+            monkeypatch.setitem(omieAPI._clientes, conta, omieAPI.OmieClient(
+                "chave", "segredo", max_tentativas=10, limitador=omieAPI.BaldeTokens(0)))
+        return servidor
+
+    servidores = []
+    monkeypatch.setattr(omieAPI, "_espera_backoff", lambda tentativa: 0)
+    yield iniciar
+    for servidor in servidores:
+        servidor.parar()
+
+
+def test_filtros_usam_o_horario_do_omie(banco, monkeypatch):
+    monkeypatch.setattr(sincronizacao, "SYNC_MARGEM_MINUTOS", 5)
+    # 15:00 UTC = 12:00 em Brasilia, independente do fuso do servidor
+    filtros = sincronizacao.filtros_alterados_desde(datetime(2026, 3, 2, 15, 0, tzinfo=timezone.utc))
+    assert filtros == {"filtrar_por_data_de": "02/03/2026", "filtrar_por_hora_de": "11:55:00"}
+
+    # Marca antiga, sem offset, e lida como horario do Omie
+    banco.salvar_estado(sincronizacao.MARCA_SINCRONIZACAO, "2026-03-02T12:00:00")
+    assert sincronizacao.ultima_sincronizacao() == datetime(2026, 3, 2, 15, 0, tzinfo=timezone.utc)
+
+
+def test_sincronizacao_completa_busca_todas_as_paginas(banco, omie):
+    omie(produtos=1050)
+    resultado = sincronizacao.sincronizar_produtos(incremental=False)
+    assert resultado == {"modo": "completo", "produtos": 1050, "gravados": 1050}
+    assert len(banco.buscar_todos_produtos()) == 1050
+    catalogo.obter_catalogo()
+    # Os timers ficam nos caminhos que a sincronizacao e o catalogo realmente usam
+    texto = metricas.OPERACAO_DURACAO.renderizar()
+    for operacao in ("sincronizar_produtos", "omie_listar_produtos", "ler_catalogo"):
+        assert f'operacao_duracao_segundos_count{{operacao="{operacao}"}}' in texto
+
+
+def test_sincronizacao_incremental_grava_apenas_alterados(banco, omie):
+    servidor = omie(produtos=300)
+    sincronizacao.sincronizar_produtos()
+
+    servidor.catalogo.alterar([5, 17, 299])
+    resultado = sincronizacao.sincronizar_produtos()
+    assert resultado == {"modo": "incremental", "produtos": 3, "gravados": 3}
+
+    resultado = sincronizacao.sincronizar_produtos()
+    assert resultado["gravados"] == 0
+
+
+def test_sincronizacao_resiste_a_erros_temporarios(banco, omie):
+    servidor = omie(produtos=500, taxa_erro=0.3)
+    resultado = sincronizacao.sincronizar_produtos(incremental=False)
+    assert resultado["gravados"] == 500
+    assert servidor.erros_injetados > 0
+
+
+def test_sincronizacao_interrompida_retoma_do_checkpoint(banco, omie, monkeypatch):
+    servidor = omie(produtos=1000)
+    monkeypatch.setattr(sincronizacao, "OMIE_REGISTROS_POR_PAGINA", 100)
+    cliente = omieAPI._clientes["padrao"]
+    listar = cliente.listar_produtos
+
+    def falhar_na_pagina_7(pagina, *args, **kwargs):
+        if pagina == 7:
+            raise omieAPI.ErroOmie("ERROR: servico indisponivel")
+        return listar(pagina, *args, **kwargs)
+
+    monkeypatch.setattr(cliente, "listar_produtos", falhar_na_pagina_7)
+    with pytest.raises(omieAPI.ErroOmie):
+        sincronizacao.sincronizar_produtos(incremental=False)
+    assert len(banco.buscar_todos_produtos()) == 600
+    assert json.loads(banco.obter_estado(sincronizacao.CHECKPOINT_SINCRONIZACAO))["pagina"] == 6
+    assert sincronizacao.ultima_sincronizacao() is None
+
+    monkeypatch.setattr(cliente, "listar_produtos", listar)
+    chamadas = servidor.chamadas
+    progresso = {}
+    resultado = sincronizacao.sincronizar_produtos(incremental=False, progresso=lambda **v: progresso.update(v))
+    assert resultado == {"modo": "completo", "produtos": 400, "gravados": 400}
+    assert progresso["retomada_da_pagina"] == 7
+    assert servidor.chamadas - chamadas == 4
+    assert len(banco.buscar_todos_produtos()) == 1000
+    assert banco.obter_estado(sincronizacao.CHECKPOINT_SINCRONIZACAO) is None
+    assert sincronizacao.ultima_sincronizacao() is not None
+
+
+def test_sincronizacao_interrompida_para_antes_de_gravar(banco, omie, monkeypatch):
+    omie(produtos=1000)
+    monkeypatch.setattr(sincronizacao, "OMIE_REGISTROS_POR_PAGINA", 100)
+    interromper = threading.Event()
+
+    def progresso(paginas_recebidas=None, **_):
+        if paginas_recebidas == 3:
+            interromper.set()
+
+    with pytest.raises(sincronizacao.SincronizacaoInterrompida):
+        sincronizacao.sincronizar_produtos(incremental=False, progresso=progresso, interromper=interromper)
+    assert len(banco.buscar_todos_produtos()) == 300
+    assert json.loads(banco.obter_estado(sincronizacao.CHECKPOINT_SINCRONIZACAO))["pagina"] == 3
+
+
+def test_contas_sincronizam_em_paralelo_em_particoes_separadas(banco, duas_contas, omie):
+    servidor = omie(produtos=300)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        resultados = list(executor.map(lambda conta: sincronizacao.sincronizar_produtos(conta=conta),
+                                       ["padrao", "filial"]))
+    assert [r["gravados"] for r in resultados] == [300, 300]
+    # Mesmo codigo nas duas contas, uma linha em cada
+    assert len(banco.buscar_todos_produtos()) == 300
+    assert len(banco.buscar_todos_produtos(conta="filial")) == 300
+    assert sincronizacao.ultima_sincronizacao("filial") is not None
+
+    versao_padrao = banco.versao_catalogo()
+    servidor.catalogo.alterar([5, 17])
+    assert sincronizacao.sincronizar_produtos(conta="filial")["gravados"] == 2
+    assert banco.versao_catalogo() == versao_padrao
+    assert banco.versao_catalogo("filial") != versao_padrao
+
+    alterado = banco.buscar_todos_produtos(conta="filial")[5]
+    codigo = alterado["codigo"]
+    assert banco.buscar_produtos_por_codigos([codigo], conta="filial")[codigo]["descricao"] == alterado["descricao"]
+    assert banco.buscar_produtos_por_codigos([codigo])[codigo]["descricao"] != alterado["descricao"]
+    assert len(catalogo.obter_catalogo("filial")) == len(catalogo.obter_catalogo()) == 300
+    # Descricao alterada ("... rev1") so existe na filial
+    assert len(banco.buscar_produtos_texto("rev1", conta="filial")) == 2
+    assert banco.buscar_produtos_texto("rev1") == []
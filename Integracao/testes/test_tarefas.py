@@ -0,0 +1,40 @@
+import threading
+
+import tarefas
+
+
+def test_submissoes_repetidas_reaproveitam_a_tarefa_ativa():
+    liberar = threading.Event()
+    chamadas = []
+
+    def trabalho(valor, progresso):
+        chamadas.append(valor)
+        progresso(etapa="esperando")
+        liberar.wait(5)
+        return valor * 2
+
+    primeira = tarefas.submeter("teste", trabalho, 21, chave="teste-coalescer")
+    segunda = tarefas.submeter("teste", trabalho, 99, chave="teste-coalescer")
+    assert segunda is primeira
+
+    liberar.set()
+    assert primeira.aguardar(5)
+    assert primeira.estado == tarefas.CONCLUIDA
+    assert primeira.resultado == 42
+    assert primeira.progresso == {"etapa": "esperando"}
+    assert chamadas == [21]
+    assert tarefas.obter_tarefa(primeira.id) is primeira
+
+    terceira = tarefas.submeter("teste", trabalho, 1, chave="teste-coalescer")
+    assert terceira is not primeira
+    assert terceira.aguardar(5)
+
+
+def test_falha_fica_registrada_na_tarefa():
+    def trabalho(progresso):
+        raise RuntimeError("Omie fora do ar")
+
+    tarefa = tarefas.submeter("teste", trabalho, chave="teste-falha")
+    assert tarefa.aguardar(5)
+    assert tarefa.estado == tarefas.FALHOU
+    assert tarefa.erro == "Omie fora do ar"